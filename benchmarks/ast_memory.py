@@ -0,0 +1,88 @@
+"""Memory held by parsed AST of tests/data/real configs.
+
+Every file is parsed with SLY lexer + parser and with plain scanner,
+reported size is sys.getsizeof() sum of all distinct objects reachable
+from the AST (shared strings and nodes are counted once). Walks both
+tuple/list nodes and __slots__ nodes, so it works on older trees too.
+
+    PYTHONPATH=. python3 benchmarks/ast_memory.py [FILE...]
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+
+from merge_config_plus import MCPLexer, MCPParser
+from merge_config_plus.plain import MCPPlain
+
+DEFAULT = sorted(
+    glob.glob(os.path.join(os.path.dirname(__file__), "..", "tests", "data", "real", "*"))
+)
+
+
+def parse_sly(text, path):
+    lexer = MCPLexer()
+    parser = MCPParser()
+    return parser.parse(lexer.tokenize(text, file=path))
+
+
+def parse_plain(text, path):
+    return MCPPlain().scan(text, path)
+
+
+def deepsize(obj):
+    seen = set()
+    size = 0
+    stack = [obj]
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, (tuple, list)):
+            stack.extend(obj)
+        else:
+            for name in getattr(obj.__class__, "__slots__", ()):
+                stack.append(getattr(obj, name, None))
+
+    return size
+
+
+def measure(func, text, path):
+    ast = func(text, path)
+    return deepsize(ast), len(ast)
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("files", nargs="*", default=DEFAULT)
+    args = argparser.parse_args()
+
+    logging.getLogger("mcp").setLevel(logging.INFO)
+
+    # build parser tables before measurements
+    MCPParser()
+
+    print("{:<16} {:>6} {:>10} {:>10}".format("file", "items", "sly", "plain"))
+    for file in args.files:
+        path = os.path.abspath(file)
+        with open(path, "r") as f:
+            text = f.read()
+
+        sly, items = measure(parse_sly, text, path)
+        plain, _ = measure(parse_plain, text, path)
+
+        print(
+            "{:<16} {:>6} {:>9.1f}K {:>9.1f}K".format(
+                os.path.basename(path), items, sly / 1024, plain / 1024
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
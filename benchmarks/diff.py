@@ -0,0 +1,88 @@
+"""Time of %(diff) on tests/data/real configs.
+
+Pairs are the same file, file with seeded random edits and two different
+files. Every pair is diffed with difflib.unified_diff() directly and with
+%(diff) function (that skips equal texts and doesn't build hunks list).
+
+    PYTHONPATH=. python3 benchmarks/diff.py [--edits N] [--repeat N]
+"""
+
+import argparse
+import difflib
+import glob
+import os
+import random
+import time
+
+from merge_config_plus import MCPAst
+from merge_config_plus.functions import functions
+
+REAL = os.path.join(os.path.dirname(__file__), "..", "tests", "data", "real")
+
+
+def read(name):
+    with open(os.path.join(REAL, name), "r") as f:
+        return f.read()
+
+
+def edited(text, edits, seed=0):
+    rand = random.Random(seed)
+    lines = text.split("\n")
+    for _ in range(edits):
+        i = rand.randrange(len(lines))
+        op = rand.random()
+        if op < 0.3:
+            del lines[i]
+        elif op < 0.6:
+            lines.insert(i, "CONFIG_NEW_{}=y".format(rand.randrange(1000)))
+        else:
+            lines[i] += "x"
+    return "\n".join(lines)
+
+
+def measure(func, a, b, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        r = func(a, b)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(r)
+
+
+def plain(a, b):
+    return "".join(list(difflib.unified_diff(a.split("\n"), b.split("\n"), n=6)))
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--edits", type=int, default=200)
+    argparser.add_argument("--repeat", type=int, default=5)
+    args = argparser.parse_args()
+
+    ast = MCPAst()
+    method = functions["diff"].method
+    mcp = lambda a, b: method(ast, [a, b], 0, "benchmark")
+
+    names = sorted(os.path.basename(path) for path in glob.glob(os.path.join(REAL, "*")))
+    pairs = list()
+    for name in names:
+        text = read(name)
+        pairs.append((name + " same", text, text))
+        pairs.append((name + " edited", text, edited(text, args.edits)))
+    for first, second in zip(names, names[1:]):
+        pairs.append((first + " " + second, read(first), read(second)))
+
+    print("{:<32} {:>10} {:>10} {:>10}".format("pair", "difflib", "%(diff)", "output"))
+    for title, a, b in pairs:
+        old, size = measure(plain, a, b, args.repeat)
+        new, _ = measure(mcp, a, b, args.repeat)
+        print(
+            "{:<32} {:>9.1f}ms {:>9.1f}ms {:>9.1f}K".format(
+                title, old * 1000, new * 1000, size / 1024
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Disabled debug logging overhead on tests/data/real/kernel.config.
+
+Compares lazy debug formatting (current) with eager pprint.pformat()
+of every token and AST node, as it was done before.
+
+    PYTHONPATH=. python3 benchmarks/logging_bench.py [-n RUNS] [FILE]
+"""
+
+import argparse
+import logging
+import os
+import pprint
+import timeit
+
+import merge_config_plus.ast
+import merge_config_plus.lexer
+import merge_config_plus.parser
+from merge_config_plus import MCPLexer, MCPParser, MCPAst
+
+MODULES = (merge_config_plus.ast, merge_config_plus.lexer, merge_config_plus.parser)
+DEFAULT = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "data", "real", "kernel.config"
+)
+
+
+def run(text, path):
+    lexer = MCPLexer()
+    parser = MCPParser()
+    ast = MCPAst()
+
+    lexer.textAdd(text, path)
+    ast.process(parser.parse(lexer.tokenize2()))
+
+
+def measure(text, path, runs):
+    return min(timeit.repeat(lambda: run(text, path), number=1, repeat=runs))
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-n", "--runs", type=int, default=5)
+    argparser.add_argument("file", nargs="?", default=DEFAULT)
+    args = argparser.parse_args()
+
+    path = os.path.abspath(args.file)
+    with open(path, "r") as f:
+        text = f.read()
+
+    logging.getLogger("mcp").setLevel(logging.INFO)
+
+    lazy = measure(text, path, args.runs)
+
+    for module in MODULES:
+        module.pformat_lazy = pprint.pformat
+    eager = measure(text, path, args.runs)
+
+    print("file:  {}".format(os.path.relpath(path)))
+    print("eager: {:.3f}s".format(eager))
+    print("lazy:  {:.3f}s".format(lazy))
+    print("gain:  {:.1f}x".format(eager / lazy))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,4 +2,9 @@
 
 BASEDIR=$(dirname "$0")
 
+# --serve daemon is used if it's running on MCP_SOCKET
+if [ -n "${MCP_SOCKET}" ]; then
+    PYTHONPATH=${BASEDIR} exec /usr/bin/env python3 ${BASEDIR}/merge_config_plus_client.py $@
+fi
+
 PYTHONPATH=${BASEDIR} /usr/bin/env python3 -m merge_config_plus $@ 
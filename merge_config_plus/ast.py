@@ -1,76 +1,205 @@
 from .lexer import MCPLexer
 from .parser import MCPParser
-from .format import MCPFormat
+from .format import MCPFormat, MCPTemplate
+from .configs import MCPConfigs, MCPRope
+from .remove import MCPRemover
+from .files import files
+from .cache import MCPShellCache, MCPManifest
+from .log import pformat_lazy
+from . import nodes
+from .functions import functions, function, coroutine
 
 import os
 import io
+import asyncio
 import subprocess
+import multiprocessing
 from subprocess import PIPE
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from packaging.version import Version
 import difflib
 import logging
-import pprint
 
 
-class MCPAst:
+class MCPShared:
+    """State shared by MCPAst and all its %(process) sub runs.
+
+    Sub runs have their own vars and defines, but reuse parser (with its
+    parsed texts) and results of previous identical %(process) calls.
+    Parser of the top-level run is used if given.
+    """
+
+    def __init__(self, parser=None):
+        self.parser = parser or MCPParser()
+        # (text, calling file) -> formatted output
+        self.processes = dict()
+        # absolute path of %(save) or main output -> True if file was
+        # changed by the run, False if it already had the same content
+        self.outputs = dict()
+        # files and %(shell) calls results depend on, see MCPRunCache
+        self.manifest = MCPManifest()
+        # runs %(process) calls started ahead, see MCPAst.processPrefetch()
+        self.processpool = None
+
+    # Workers are forked, so they start with parser and previous results
+    # already in place (and nothing is imported again). Returns None if
+    # fork isn't available, then calls are run in place.
+    def processPool(self, jobs):
+        if self.processpool is None:
+            if "fork" not in multiprocessing.get_all_start_methods():
+                return None
+            self.processpool = ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=processWorkerInit,
+                initargs=(self, logging.getLogger("mcp").getEffectiveLevel()),
+            )
+        return self.processpool
+
+    def shutdown(self):
+        if self.processpool is not None:
+            self.processpool.shutdown(wait=True)
+            self.processpool = None
+
+
+# Log records of current processWorker() call
+class MCPRecords(logging.Handler):
     def __init__(self):
+        super().__init__()
+        self.records = list()
+
+    def emit(self, record):
+        # args can't be pickled (pformat_lazy), message is built here
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            self.format(record)
+            record.exc_info = None
+        self.records.append(record)
+
+
+# MCPAst and log handler of process pool worker
+worker = None
+
+
+def processWorkerInit(shared, level):
+    global worker
+
+    handler = MCPRecords()
+    logger = logging.getLogger("mcp")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(level)
+
+    # sub runs of worker don't start anything ahead
+    worker = tuple((MCPAst(shared=shared), handler))
+
+
+def processWorker(args, line, file):
+    """Runs %(process) call in pool worker.
+
+    Returns result, log records, number of errors, shell cache hits and
+    misses, saved outputs and manifest, see MCPAst.processReplay().
+    """
+    ast, handler = worker
+    shellcache = ast.shellcache
+
+    ast.num_errors = 0
+    ast.shared.outputs = dict()
+    ast.shared.manifest = MCPManifest()
+    handler.records = list()
+    hits, misses = shellcache.hits, shellcache.misses
+
+    r = ast.func_process(args, line, file)
+
+    return tuple(
+        (
+            r,
+            handler.records,
+            ast.num_errors,
+            shellcache.hits - hits,
+            shellcache.misses - misses,
+            ast.shared.outputs,
+            ast.shared.manifest,
+        )
+    )
+
+
+class MCPAst:
+    # shared by all instances (sub processing too), see func_shell
+    shellcache = MCPShellCache()
+
+    # history - keep every assigned value of var (for "Previously" output),
+    # otherwise var holds only its last value
+    # jobs - max number of %(shell) commands and %(process) sub runs
+    # running at once, see prefetchPlan()
+    # shared - MCPShared of parent run (for sub processing)
+    # parser - parser of top-level run, sub runs reuse it (if no shared)
+    def __init__(self, history=False, jobs=1, shared=None, parser=None):
         self.logger = logging.getLogger("mcp.ast")
+        self.history = history
+        self.jobs = jobs
+        # run that created shared state also releases it
+        self.owner = shared is None
+        self.shared = shared or MCPShared(parser)
+        self.shellpool = None
         self.reset()
 
     def reset(self):
-        self.configs = list()
+        self.configs = MCPConfigs()
         self.defines = dict()
+        # define name -> Define node, see checkpoint()
+        self.definitions = dict()
         self.num_errors = 0
+        # (function name, args key) -> started calls, taken in program order
+        self.prefetched = dict()
+        # shell cache keys of started calls, later ones take cached result
+        self.shellkeys = set()
 
     def configAdd(self, name, typ, value, lineno, file):
-        number = 0
-        for item in self.configs:
-            if item[0] == "config" and item[1] == name:
-                if item[2][-1][0] != typ:
-                    self.logger.warning(
-                        "{name} rewrited with type change ({old}->{new})".format(
-                            name=name, old=item[2][-1][0], new=typ
-                        )
+        item = self.configs.get(name)
+        if item is not None:
+            if item[2][-1][0] != typ:
+                self.logger.warning(
+                    "{name} rewrited with type change ({old}->{new})".format(
+                        name=name, old=item[2][-1][0], new=typ
                     )
-                    self.num_errors += 1
-                else:
-                    self.logger.debug("Rewrited in configs:")
+                )
+                self.num_errors += 1
+            else:
+                self.logger.debug("Rewrited in configs:")
 
-                newitem = item
-                new = tuple((str(typ), value, lineno, file))
-                newitem[2].append(new)
-                self.configs.append(newitem)
+            new = tuple((str(typ), value, lineno, file))
+            if self.history:
+                item[2].append(new)
+            else:
+                item[2][0] = new
 
-                if name.find("LOCAL_") != 0:
-                    newolditem = tuple(("comment", " "+item[1]+" was '"+str(item[2][-1][1])+"'")) #, [tuple((str(typ), value, lineno, file))]))
-                    self.configs[number] = newolditem
-                else:
-                    self.configs.remove(item)
+            # old place keeps "was" comment, LOCAL_ vars are just moved
+            self.configs.move(name, value, tombstone=(name.find("LOCAL_") != 0))
 
-                self.logger.debug(pprint.pformat(new))
-                return
-            number += 1
+            self.logger.debug("%s", pformat_lazy(new))
+            return
 
         append = tuple(("config", str(name), [tuple((str(typ), value, lineno, file))]))
         self.configs.append(append)
         self.logger.debug("Added to configs as config:")
-        self.logger.debug(pprint.pformat(append))
+        self.logger.debug("%s", pformat_lazy(append))
 
     def configAddComment(self, comment):
         append = tuple(("comment", comment))
         self.configs.append(append)
         self.logger.debug("Added to configs as comment:")
-        self.logger.debug(pprint.pformat(append))
+        self.logger.debug("%s", pformat_lazy(append))
 
     # third return param is config item exist in list or not
     def configValue(self, name, strict=True):
         r = None
 
-        for item in self.configs:
-            if item[0] == "config" and item[1] == name:
-                tmp = item[2][-1]
-                r = tuple((str(tmp[1]), str(tmp[0]), True))
-                break
+        item = self.configs.get(name)
+        if item is not None:
+            tmp = item[2][-1]
+            r = tuple((str(tmp[1]), str(tmp[0]), True))
 
         if not r:
             r = "", "string", False
@@ -83,6 +212,23 @@ class MCPAst:
 
         return r
 
+    # Same as configValue(name, strict=False), but MCPRope values are not
+    # joined, += and =+ extend them
+    def configRaw(self, name):
+        item = self.configs.get(name)
+        if item is None:
+            r = "", "string", False
+        else:
+            tmp = item[2][-1]
+            value = tmp[1]
+            if value.__class__ is not MCPRope:
+                value = str(value)
+            r = tuple((value, str(tmp[0]), True))
+
+        self.logger.debug(r)
+
+        return r
+
     def realOutput(self):
         name, _, exist = self.configValue("LOCAL_OUTPUT_REAL_NAME", strict=False)
         
@@ -94,21 +240,61 @@ class MCPAst:
     # Functions
 
     # input text...
+    @function("process", args=(0, None), io=True, side_effects=True)
     def func_process(self, args, line, file):
         self.logger.debug("func_process:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
+
+        r = self.processCached(args, file)
+        if r is not None:
+            return r
+
+        future = self.prefetchTake("process", self.processKey(args, file))
+        if future is not None:
+            return self.processReplay(args, file, future.result())
+
+        lexer, ast, base_dir = self.processPrepare(args, file)
+        items, parser_errors = self.processParse(lexer)
+        ast.process(items)
+        return self.processFinish(args, file, lexer, ast, base_dir, parser_errors)
+
+    @coroutine("process")
+    async def func_process_async(self, args, line, file):
+        self.logger.debug("func_process_async:")
+        self.logger.debug("%s", pformat_lazy(args))
+
+        r = self.processCached(args, file)
+        if r is not None:
+            return r
+
+        lexer, ast, base_dir = self.processPrepare(args, file)
+        items, parser_errors = self.processParse(lexer)
+        await ast.process_async(items)
+        return self.processFinish(args, file, lexer, ast, base_dir, parser_errors)
+
+    # Output of identical previous call: history comments refer to
+    # calling file, so it is a part of the key too
+    def processKey(self, args, file):
+        text = ""
+        for arg in args:
+            text += arg + "\n"
+        return tuple((text, os.path.abspath(file)))
+
+    def processCached(self, args, file):
+        r = self.shared.processes.get(self.processKey(args, file))
+        if r is not None:
+            self.logger.debug("Process function result taken from previous call")
+        return r
 
+    def processPrepare(self, args, file):
         base_dir = os.path.abspath(os.path.dirname(file))
+        text, path = self.processKey(args, file)
 
         lexer = MCPLexer()
-        parser = MCPParser()
-        ast = MCPAst()
+        # sub processing output always includes vars history
+        ast = MCPAst(history=True, jobs=self.jobs, shared=self.shared)
 
-        text = ""
-        for arg in args:
-            text += arg + "\n"
-
-        lexer.textAdd(text, os.path.abspath(file), "config that invoke supbrocess")
+        lexer.textAdd(text, path, "config that invoke supbrocess")
 
         self.logger.info("Process function starting sub processing...")
         ast.configAdd("LOCAL_BASE", "string", base_dir, 0, "/")
@@ -120,12 +306,22 @@ class MCPAst:
         #    local_generated = base_dir
         #ast.configAdd("LOCAL_GENERATED", "string", local_generated, 0, "/")
 
-        ast.process(parser.parse(lexer.tokenize2()))
+        return lexer, ast, base_dir
+
+    # Parses with shared parser, returns items and number of parser errors
+    def processParse(self, lexer):
+        parser = self.shared.parser
+        num_errors = parser.num_errors
+        items = parser.parse2(lexer)
+        return items, parser.num_errors - num_errors
+
+    def processFinish(self, args, file, lexer, ast, base_dir, parser_errors):
         self.logger.info("Process function finished")
+        self.shared.manifest.files.update(lexer.reads)
 
         num_errors = 0
         num_errors += lexer.num_errors
-        num_errors += parser.num_errors
+        num_errors += parser_errors
         num_errors += ast.num_errors
 
         if num_errors > 0:
@@ -137,27 +333,17 @@ class MCPAst:
             format = MCPFormat(fake_file, base_dir)
             format.output(ast.configs)
 
-            return fake_file.getvalue().strip()
-
-    def do_format(self, s, **kwargs):
-        """Replaces missing keys with a pattern."""
-        RET = "{{{}}}"
-        try:
-            return s.format(**kwargs)
-        except KeyError as e:
-            keyname = e.args[0]
-            self.logger.warning(
-                "Var '{key}' required by template, but not provided".format(key=keyname)
-            )
-            self.num_errors += 1
-            return self.do_format(s, **{keyname: RET.format(keyname)}, **kwargs)
+            r = fake_file.getvalue().strip()
+            self.shared.processes[self.processKey(args, file)] = r
+            return r
 
     # * template
     # * templating vars
     # * templating vars...
+    @function("format", args=(1, None), pure=True)
     def func_format(self, args, line, file):
         self.logger.debug("func_format:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
 
         template = ""
         raw = ""
@@ -168,26 +354,64 @@ class MCPAst:
         for item in args[1:]:
             raw += item + "\n"
 
-        lines = raw.splitlines()
-        vars = dict()
-        for line0 in lines:
-            splited = line0.strip().split("=")
-            if len(splited) != 2:
-                self.logger.error(
-                    "Format function can`t parse '{line0}' on {file}:{line}".format(
-                        line0=line0, line=line, file=file
-                    )
+        vars, bad = MCPTemplate.vars(raw)
+        for line0 in bad:
+            self.logger.error(
+                "Format function can`t parse '{line0}' on {file}:{line}".format(
+                    line0=line0, line=line, file=file
                 )
-                self.num_errors += 1
-                continue
-            vars[splited[0]] = str(splited[1]).strip()
+            )
+            self.num_errors += 1
 
-        return self.do_format(template, **vars)
+        r, missing = MCPTemplate.get(template).render(vars)
+        for keyname in missing:
+            self.logger.warning(
+                "Var '{key}' required by template, but not provided".format(key=keyname)
+            )
+            self.num_errors += 1
+        return r
 
+    @function("shell", args=(1, None), io=True, side_effects=True)
     def func_shell(self, args, line, file):
         self.logger.debug("func_shell:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
 
+        if not self.shellCheck(args, line, file):
+            return ""
+
+        key = self.shellUse(args, file)
+        stdout = self.shellCached(args, key)
+        if stdout is not None:
+            return stdout
+
+        try:
+            result = self.shellRun(args)
+        except Exception as e:
+            return self.shellError(e, args, line, file)
+
+        return self.shellResult(args, result, key, line, file)
+
+    @coroutine("shell")
+    async def func_shell_async(self, args, line, file):
+        self.logger.debug("func_shell_async:")
+        self.logger.debug("%s", pformat_lazy(args))
+
+        if not self.shellCheck(args, line, file):
+            return ""
+
+        key = self.shellUse(args, file)
+        stdout = self.shellCached(args, key)
+        if stdout is not None:
+            return stdout
+
+        try:
+            result = await self.shellExecAsync(args)
+        except Exception as e:
+            return self.shellError(e, args, line, file)
+
+        return self.shellResult(args, result, key, line, file)
+
+    def shellCheck(self, args, line, file):
         if len(args) < 1:
             self.logger.error(
                 "Shell function requires at least one argument on {file}:{line}".format(
@@ -195,7 +419,7 @@ class MCPAst:
                 )
             )
             self.num_errors += 1
-            return ""
+            return False
 
         if args[0].strip() == "":
             self.logger.error(
@@ -204,59 +428,127 @@ class MCPAst:
                 )
             )
             self.num_errors += 1
-            return ""
+            return False
 
-        try:
-            result = subprocess.run(
-                args, timeout=5, stdout=PIPE, stderr=PIPE, check=False
-            )
+        return True
 
-            if result.returncode != 0:
-                self.logger.error(
-                    "Shell '{name}' returns error {ret} on {file}:{line}".format(
-                        name=args[0], ret=result.returncode, line=line, file=file
-                    )
+    def shellCached(self, args, key):
+        if key is None:
+            return None
+
+        stdout = self.shellcache.load(key)
+        if stdout is not None:
+            self.logger.debug("Shell '%s' result taken from cache", args[0])
+        return stdout
+
+    def shellResult(self, args, result, key, line, file):
+        if result.returncode != 0:
+            self.logger.error(
+                "Shell '{name}' returns error {ret} on {file}:{line}".format(
+                    name=args[0], ret=result.returncode, line=line, file=file
                 )
-                if result.stderr:
-                    self.logger.error("Stderr below:")
-                    for line in result.stderr.splitlines():
-                        self.logger.error(line)
-                    self.logger.error("-----")
-                self.num_errors += 1
+            )
+            if result.stderr:
+                self.logger.error("Stderr below:")
+                for line in result.stderr.splitlines():
+                    self.logger.error(line)
+                self.logger.error("-----")
+            self.num_errors += 1
+        elif key is not None:
+            self.shellcache.store(key, result.stdout)
 
-            return result.stdout
-        except FileNotFoundError:
+        return result.stdout
+
+    def shellError(self, e, args, line, file):
+        if isinstance(e, FileNotFoundError):
             self.logger.error(
                 "Shell cmd '{name}' not found on {file}:{line}".format(
                     name=args[0], line=line, file=file
                 )
             )
             self.num_errors += 1
-        except subprocess.CalledProcessError as e:
-            self.logger.critical("func_shell: internal error!")
-            self.num_errors += 1
-            print(e)
-            exit(1)
-        except Exception as e:
-            self.logger.critical("func_shell: internal error!")
-            self.num_errors += 1
-            print(e)
-            exit(1)
-
-        return ""
+            return ""
 
+        self.logger.critical("func_shell: internal error!")
+        self.num_errors += 1
+        print(e)
+        exit(1)
+
+    # Shell results are cached only if LOCAL_SHELL_CACHE=y is set, key covers
+    # argv, current dir, vars from LOCAL_SHELL_CACHE_ENV (PATH by default)
+    # and content of LOCAL_SHELL_CACHE_INPUTS files (relative to config file)
+    def shellKey(self, args, file):
+        inputs = self.shellInputs(file)
+        if inputs is None:
+            return None
+        return self.shellcache.key(args, *inputs)
+
+    # Same as shellKey(), call is added to manifest of the run
+    def shellUse(self, args, file):
+        inputs = self.shellInputs(file)
+        if inputs is None:
+            self.shared.manifest.volatile = True
+            return None
+
+        key = self.shellcache.key(args, *inputs)
+        self.shared.manifest.shells[tuple((tuple(args),) + inputs)] = key
+        return key
+
+    # Returns environment var names and input file paths of shell cache
+    # key, None if shell results aren't cached
+    def shellInputs(self, file):
+        if not self.shellcache.enabled:
+            return None
+
+        enabled, _, _ = self.configValue("LOCAL_SHELL_CACHE", strict=False)
+        if str(enabled) != "y":
+            return None
+
+        env, _, exist = self.configValue("LOCAL_SHELL_CACHE_ENV", strict=False)
+        if not exist:
+            env = "PATH"
+
+        inputs = list()
+        value, _, _ = self.configValue("LOCAL_SHELL_CACHE_INPUTS", strict=False)
+        for path in str(value).split():
+            if path[0] != "/":
+                path = os.path.dirname(file) + "/" + path
+            inputs.append(os.path.abspath(path))
+
+        return tuple((tuple(str(env).split()), tuple(inputs)))
+
+    @function("strip", args=(0, None), pure=True)
     def func_strip(self, args, line, file):
         self.logger.debug("func_strip:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
 
         str = ""
         for arg in args:
             str += arg
         return str.strip()
 
+    # * text
+    # * substrings to remove...
+    @function("remove", args=(1, None), pure=True)
+    def func_remove(self, args, line, file):
+        self.logger.debug("func_remove:")
+        self.logger.debug("%s", pformat_lazy(args))
+
+        if len(args) < 1:
+            self.logger.error(
+                "Remove function requires text on {file}:{line}".format(
+                    line=line, file=file
+                )
+            )
+            self.num_errors += 1
+            return ""
+
+        return MCPRemover.get(args[1:]).apply(args[0])
+
+    @function("diff", args=(2, 2), pure=True)
     def func_diff(self, args, line, file):  # TODO
         self.logger.debug("func_diff:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
 
         if len(args) < 2:
             self.logger.error(
@@ -267,15 +559,35 @@ class MCPAst:
             self.num_errors += 1
             return ""
 
+        # no hunks, difflib would still match the whole texts
+        if args[0] == args[1]:
+            return ""
+
         # TODO maybe filter --- +++
-        return "".join(
-            list(difflib.unified_diff(args[0].split("\n"), args[1].split("\n"), n=6))
-        )
+        return "".join(difflib.unified_diff(args[0].split("\n"), args[1].split("\n"), n=6))
 
+    @function("call", args=(1, None), side_effects=True)
     def func_call(self, args, line, file):
         self.logger.debug("func_call:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
+
+        for define in self.callDefines(args, line, file):
+            define()
+
+        return ""
+
+    @coroutine("call")
+    async def func_call_async(self, args, line, file):
+        self.logger.debug("func_call_async:")
+        self.logger.debug("%s", pformat_lazy(args))
 
+        for define in self.callDefines(args, line, file):
+            await define()
+
+        return ""
+
+    # Yields compiled defines to run, errors are reported on the way
+    def callDefines(self, args, line, file):
         for arg in args:
             name = arg.strip()
             if name == "":
@@ -288,7 +600,7 @@ class MCPAst:
                 continue
 
             if name in self.defines:
-                self.ast_root(self.defines[name])
+                yield self.defines[name]
             else:
                 self.logger.error(
                     "Call to unknown define '{define}' on {file}:{line}".format(
@@ -298,11 +610,10 @@ class MCPAst:
                 self.num_errors += 1
                 continue
 
-        return ""
-
+    @function("file", args=(0, None), io=True)
     def func_file(self, args, line, file):
         self.logger.debug("func_file:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
 
         base_dir = os.path.dirname(file)
 
@@ -315,21 +626,117 @@ class MCPAst:
                 path = base_dir + "/" + arg
 
             try:
-                f = open(path, "r")
-                r += f.read()
-                f.close()
+                data = self.fileRead(path)
             except Exception as e:
                 self.logger.error(
                     "{msg} on {file}:{line}".format(msg=e, line=line, file=file)
                 )
                 self.num_errors += 1
+                continue
+
+            self.shared.manifest.files[path] = data
+            r += data
 
         return r
 
+    @coroutine("file")
+    async def func_file_async(self, args, line, file):
+        self.logger.debug("func_file_async:")
+        self.logger.debug("%s", pformat_lazy(args))
+
+        base_dir = os.path.dirname(file)
+        loop = asyncio.get_running_loop()
+
+        paths = list()
+        reads = list()
+        for arg in args:
+            if arg[0] == "/":
+                path = arg
+            else:
+                path = base_dir + "/" + arg
+            paths.append(path)
+            reads.append(loop.run_in_executor(None, self.fileRead, path))
+
+        r = ""
+
+        results = await asyncio.gather(*reads, return_exceptions=True)
+        for path, data in zip(paths, results):
+            if isinstance(data, Exception):
+                self.logger.error(
+                    "{msg} on {file}:{line}".format(msg=data, line=line, file=file)
+                )
+                self.num_errors += 1
+            else:
+                self.shared.manifest.files[path] = data
+                r += data
+
+        return r
+
+    @staticmethod
+    def fileRead(path):
+        return files.read(path)
+
+    @function("save", args=(1, None), io=True, side_effects=True)
     def func_save(self, args, line, file):
         self.logger.debug("func_save:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
+
+        path = self.savePath(args, line, file)
+        if path is None:
+            return ""
+
+        try:
+            text = "".join(args[1:])
+            written = self.saveWrite(path, text)
+        except Exception as e:
+            self.logger.error(
+                "{msg} on {file}:{line}".format(msg=e, line=line, file=file)
+            )
+            self.num_errors += 1
+            return ""
+
+        self.outputAdd(path, written)
+        self.shared.manifest.saved[os.path.abspath(path)] = text
+        return os.path.abspath(path)
+
+    @coroutine("save")
+    async def func_save_async(self, args, line, file):
+        self.logger.debug("func_save_async:")
+        self.logger.debug("%s", pformat_lazy(args))
+
+        path = self.savePath(args, line, file)
+        if path is None:
+            return ""
 
+        try:
+            text = "".join(args[1:])
+            written = await asyncio.get_running_loop().run_in_executor(
+                None, self.saveWrite, path, text
+            )
+        except Exception as e:
+            self.logger.error(
+                "{msg} on {file}:{line}".format(msg=e, line=line, file=file)
+            )
+            self.num_errors += 1
+            return ""
+
+        self.outputAdd(path, written)
+        self.shared.manifest.saved[os.path.abspath(path)] = text
+        return os.path.abspath(path)
+
+    # Returns True if file was changed, file with the same content is
+    # left untouched (make doesn't see it as new)
+    @staticmethod
+    def saveWrite(path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return files.write(path, text)
+
+    # Adds output to the run report, see MCPShared.outputs
+    def outputAdd(self, path, written):
+        path = os.path.abspath(path)
+        self.shared.outputs[path] = self.shared.outputs.get(path, False) or written
+
+    def savePath(self, args, line, file):
         base_dir = os.path.dirname(file)
 
         if len(args) < 1:
@@ -339,7 +746,7 @@ class MCPAst:
                 )
             )
             self.num_errors += 1
-            return ""
+            return None
 
         if len(args[0].strip()) == 0:
             self.logger.error(
@@ -348,50 +755,36 @@ class MCPAst:
                 )
             )
             self.num_errors += 1
-            return ""
+            return None
 
         if args[0][0] == "/":
-            path = args[0]
-        else:
-            path = base_dir + "/" + args[0]
-    
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        try:
-            f = open(path, "w")
-        except Exception as e:
-            self.logger.error(
-                "{msg} on {file}:{line}".format(msg=e, line=line, file=file)
-            )
-            self.num_errors += 1
-
-        for arg in args[1:]:
-            f.write(arg)
-
-        f.close()
-
-        return os.path.abspath(path)
+            return args[0]
+        return base_dir + "/" + args[0]
 
+    @function("fail", args=(0, None), side_effects=True)
     def func_fail(self, args, line, file):
         self.logger.debug("func_fail:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
         msg=""
         for arg in args:
             msg += msg + arg
         self.logger.critical("{msg} on {file}:{line}".format(msg=msg.strip(), line=line, file=file))
         return ""
 
+    @function("comment", args=(0, None), side_effects=True)
     def func_comment(self, args, line, file):
         self.logger.debug("func_comment:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
         msg=""
         for arg in args:
             msg += msg + arg
         self.configAddComment(msg)
         return msg
 
+    @function("major", args=(1, 1), pure=True)
     def func_major(self, args, line, file):
         self.logger.debug("func_major:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
         if len(args) < 1:
             self.logger.error(
                 "Major function expect one arg {file}:{line}".format(
@@ -408,9 +801,10 @@ class MCPAst:
             self.num_errors += 1
         return ""
 
+    @function("minor", args=(1, 1), pure=True)
     def func_minor(self, args, line, file):
         self.logger.debug("func_minor:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
         if len(args) < 1:
             self.logger.error(
                 "Minor function expect one arg {file}:{line}".format(
@@ -427,9 +821,10 @@ class MCPAst:
             self.num_errors += 1
         return ""
 
+    @function("patch", args=(1, 1), pure=True)
     def func_patch(self, args, line, file):
         self.logger.debug("func_patch:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
         if len(args) < 1:
             self.logger.error(
                 "Patch function expect one arg {file}:{line}".format(
@@ -446,244 +841,832 @@ class MCPAst:
             self.num_errors += 1
         return ""
 
+    @function("relpath", args=(2, 2), pure=True, cwd=True)
     def func_relpath(self, args, line, file):
         self.logger.debug("func_relpath:")
-        self.logger.debug(pprint.pformat(args))
+        self.logger.debug("%s", pformat_lazy(args))
         # TODO params check
         return os.path.relpath(args[0], start=args[1])
 
-    # Ast processing
+    # Ast compiling
+    #
+    # Every node is turned once into a closure, evaluation just calls them.
+    # Root level closures take no args, value closures return value.
 
-    def ast_root(self, items):
-        self.logger.debug("ast_root:")
+    def compile(self, items):
+        self.logger.debug("compile:")
 
         if items == None:
-            return
+            return lambda: None
 
-        for item in items:
-            self.logger.debug(pprint.pformat(item))
-            if item[0] == "include":
+        steps = list()
+        flat = list()
+        self.compile_items(items, steps, flat)
+        steps = tuple(steps)
+
+        plan = None
+        if self.jobs > 1:
+            plan = self.prefetchPlan(flat)
+
+        if plan:
+
+            def run():
+                for number, step in enumerate(steps):
+                    calls = plan.get(number)
+                    if calls is not None:
+                        self.prefetch(calls)
+                    step()
+
+            return run
+
+        def run():
+            for step in steps:
+                step()
+
+        return run
+
+    # flat - items of steps, includes are expanded
+    def compile_items(self, items, steps, flat):
+        number = 0
+        while number < len(items):
+            item = items[number]
+            cls = item.__class__
+            if cls is nodes.Include:
+                # resolved includes carry included file items
+                if item.items is not None:
+                    self.compile_items(item.items, steps, flat)
+                number += 1
                 continue
-            elif item[0] == "define":
-                self.ast_define(item)
-            elif item[0] == "comment":
-                self.configAddComment(item[1])
-            elif item[0] == "config":
-                self.ast_config(item)
-            elif item[0] == "func":
-                self.ast_func(item)
-            elif item[0] == "if":
-                self.ast_if(item)
-            else:
+
+            end = self.removeBatch(items, number)
+            if end - number > 1:
+                steps.append(self.compile_remove(items[number:end]))
+                flat.append(item)
+                number = end
+                continue
+
+            method = self.compile_methods.get(cls)
+            if method is None:
                 self.logger.critical("ast_root: unknown item!")
                 exit(1)
+            steps.append(method(self, item))
+            flat.append(item)
+            number += 1
 
-    def ast_define(self, item):
-        self.logger.debug("ast_define:")
-        self.logger.debug(pprint.pformat(item))
+    # Constant -= of LOCAL_ var (without history) leaves no trace except the
+    # final value, so run of them is applied at once. Returns end of run
+    # starting at number.
+    def removeBatch(self, items, number):
+        first = items[number]
+        if (
+            self.history
+            or first.__class__ is not nodes.Config
+            or first.op != "-="
+            or first.name.find("LOCAL_") != 0
+        ):
+            return number + 1
+
+        end = number
+        while end < len(items):
+            item = items[end]
+            if (
+                item.__class__ is not nodes.Config
+                or item.op != "-="
+                or item.name != first.name
+                or self.constant(item.value) is None
+            ):
+                break
+            end += 1
+        return max(end, number + 1)
+
+    # Value of constant node as -= takes it, None if node isn't constant
+    @staticmethod
+    def constant(node):
+        cls = node.__class__
+        if cls is nodes.String:
+            r = ""
+            for part in node.parts:
+                if part.__class__ is not nodes.Str:
+                    return None
+                r += part.value
+            return r
+        elif cls in (nodes.State, nodes.Int, nodes.Hex):
+            return str(node.value)
+        return None
+
+    def compile_remove(self, items):
+        name = items[-1].name
+        lineno = items[-1].lineno
+        file = items[-1].file
+        remover = MCPRemover(tuple(self.constant(item.value) for item in items))
+
+        def run():
+            # strict false -> don`t warn if var is not exist
+            cval, ctyp, _ = self.configValue(name, strict=False)
+            if ctyp != "string":
+                cval = str(cval)
+            self.configAdd(name, "string", remover.apply(cval), lineno, file)
 
-        if item[1] in self.defines:
-            self.logger.warning("define redefine TODO")
-            self.num_errors += 1
+        return run
 
-        self.defines[item[1]] = item[2]
-
-    def ast_config(self, item):
-        self.logger.debug("ast_config:")
-        self.logger.debug(pprint.pformat(item))
-
-        t = item[3]
-
-        val = ""
-        typ = ""
-
-        if t[0] == "state":
-            val = t[1]
-            typ = "state"
-        elif t[0] == "string":
-            val = self.ast_string(t)
-            typ = "string"
-        elif t[0] == "int":
-            val = t[1]
-            typ = "int"
-        elif t[0] == "hex":
-            val = t[1]
-            typ = "hex"
-        elif t[0] == "val":
-            val, typ = self.ast_val(t)
-        elif t[0] == "func":
-            val = self.ast_func(t)
-            typ = "string"
+    def compile_comment(self, item):
+        text = item.text
+        return lambda: self.configAddComment(text)
+
+    # body - compiled item body, compile_define_async() passes async one
+    def compile_define(self, item, body=None):
+        name = item.name
+        if body is None:
+            body = self.compile(item.body)
+
+        def run():
+            self.logger.debug("ast_define: {name}".format(name=name))
+
+            if name in self.defines:
+                self.logger.warning("define redefine TODO")
+                self.num_errors += 1
+
+            self.defines[name] = body
+            self.definitions[name] = item
+
+        return run
+
+    def compile_config(self, item):
+        t = item.value
+        cls = t.__class__
+
+        if cls is nodes.State:
+            value = tuple((t.value, "state"))
+            get = lambda: value
+        elif cls is nodes.String:
+            string = self.compile_string(t)
+            get = lambda: (string(), "string")
+        elif cls is nodes.Int:
+            value = tuple((t.value, "int"))
+            get = lambda: value
+        elif cls is nodes.Hex:
+            value = tuple((t.value, "hex"))
+            get = lambda: value
+        elif cls is nodes.Val:
+            var = t.name
+
+            def get():
+                val, typ, _ = self.configValue(var)
+                return val, typ
+
+        elif cls is nodes.Func:
+            func = self.compile_func(t)
+            get = lambda: (func(), "string")
         else:
             self.logger.critical("ast_config: uknown item!")
             exit(1)
 
-        if item[2] == "=":
-            val
-            typ
-        elif item[2] == "?=":
-            # strict false -> don`t warn if var is not exist
-            _, _, exist = self.configValue(item[1], strict=False)
-            if exist == True:
-                # dont save var if already exist
-                return
-            val
-            typ
-        elif item[2] in ["+=", "=+", "-="]:
-            # strict false -> don`t warn if var is not exist
-            cval, ctyp, _ = self.configValue(item[1], strict=False)
-            if ctyp != "string":
-                cval = str(cval)
-            if typ != "string":
-                val = str(val)
-
-            if item[2] == "+=":
-                val = cval + val
-                typ = "string"
-            elif item[2] == "=+":
-                val = val + cval
-                typ = "string"
-            elif item[2] == "-=":
+        assign = self.compile_assign(item.name, item.op, item.lineno, item.file)
+        return lambda: assign(*get())
+
+    # Returns assign(val, typ) that applies op to var
+    def compile_assign(self, name, op, lineno, file):
+        if op == "=":
+
+            def assign(val, typ):
+                self.configAdd(name, typ, val, lineno, file)
+
+        elif op == "?=":
+
+            def assign(val, typ):
+                # strict false -> don`t warn if var is not exist
+                _, _, exist = self.configValue(name, strict=False)
+                if exist == True:
+                    # dont save var if already exist
+                    return
+                self.configAdd(name, typ, val, lineno, file)
+
+        elif op in ["+=", "=+"]:
+
+            def assign(val, typ):
+                cval, ctyp, _ = self.configRaw(name)
+                if ctyp != "string":
+                    cval = str(cval)
+                if typ != "string":
+                    val = str(val)
+
+                if val.__class__ is not str:
+                    # keep errors of non string values as they were
+                    cval = str(cval)
+                    val = cval + val if op == "+=" else val + cval
+                else:
+                    if cval.__class__ is not MCPRope:
+                        cval = MCPRope(cval)
+                    val = cval.append(val) if op == "+=" else cval.prepend(val)
+                self.configAdd(name, "string", val, lineno, file)
+
+        elif op == "-=":
+
+            def assign(val, typ):
+                # strict false -> don`t warn if var is not exist
+                cval, ctyp, _ = self.configValue(name, strict=False)
+                if ctyp != "string":
+                    cval = str(cval)
+                if typ != "string":
+                    val = str(val)
+
                 val = cval.replace(val, "")
-                typ = "string"
+                self.configAdd(name, "string", val, lineno, file)
+
         else:
-            self.logger.critical(
-                "ast_config: uknown operation '{op}'!".format(op=item[2])
-            )
+            self.logger.critical("ast_config: uknown operation '{op}'!".format(op=op))
             exit(1)
 
-        self.configAdd(item[1], typ, val, item[4][0], item[4][1])
-
-    def ast_val(self, item):
-        self.logger.debug("ast_val:")
-        self.logger.debug(pprint.pformat(item))
-        val, typ, _ = self.configValue(item[1])
-        return val, typ
-
-    def ast_string(self, item):
-        self.logger.debug("ast_string:")
-        self.logger.debug(pprint.pformat(item))
-
-        str0 = ""
-        for part in item[1]:
-            if part[0] == "str":
-                str0 += part[1]
-            elif part[0] == "val":
-                val, _ = self.ast_val(part)
-                str0 += str(val)
-            elif part[0] == "func":
-                str0 += self.ast_func(part)
+        return assign
+
+    def compile_string(self, item):
+        parts = list()
+
+        for part in item.parts:
+            cls = part.__class__
+            if cls is nodes.Str:
+                value = part.value
+                parts.append(lambda value=value: value)
+            elif cls is nodes.Val:
+                parts.append(self.compile_val(part))
+            elif cls is nodes.Func:
+                parts.append(self.compile_func(part))
             else:
                 self.logger.critical("ast_string: unknown item!")
                 exit(1)
 
-        self.logger.debug("ast_string final:")
-        self.logger.debug(pprint.pformat(str0))
-        return str0
+        parts = tuple(parts)
 
-    def ast_if(self, item):
-        self.logger.debug("ast_if:")
-        self.logger.debug(pprint.pformat(item))
+        def run():
+            return "".join([part() for part in parts])
 
-        left = self.ast_if_cond(item[2])
-        right = self.ast_if_cond(item[3])
+        return run
 
-        branch = None
+    # var value as string
+    def compile_val(self, item):
+        name = item.name
 
-        if item[1] == "eq":
-            if left == right:
-                branch = 4
-            else:
-                branch = 5
-        elif item[1] == "neq":
-            if left == right:
-                branch = 5
-            else:
-                branch = 4
-        else:
-            self.logger.critical("ast_if: internal error!")
-            exit(1)
+        def run():
+            val, _, _ = self.configValue(name)
+            return str(val)
 
-        self.ast_root(item[branch])
+        return run
 
-    def ast_if_cond(self, item):
-        self.logger.debug("ast_if_cond:")
-        self.logger.debug(pprint.pformat(item))
+    def compile_if(self, item):
+        left = self.compile_if_cond(item.left)
+        right = self.compile_if_cond(item.right)
+        true = self.compile(item.true)
+        false = self.compile(item.false)
+
+        if item.kind == "eq":
+
+            def run():
+                if left() == right():
+                    true()
+                else:
+                    false()
+
+        elif item.kind == "neq":
+
+            def run():
+                if left() == right():
+                    false()
+                else:
+                    true()
 
-        if item[0] == "string":
-            return self.ast_string(item)
-        elif item[0] == "val":
-            val, _ = self.ast_val(item)
-            return str(val)
-        elif item[0] == "func":
-            return self.ast_func(item)
         else:
-            self.logger.critical("ast_if_cond: internal error!")
+            self.logger.critical("ast_if: internal error!")
             exit(1)
 
-        return ""
+        return run
+
+    def compile_if_cond(self, item):
+        cls = item.__class__
+        if cls is nodes.String:
+            return self.compile_string(item)
+        elif cls is nodes.Val:
+            return self.compile_val(item)
+        elif cls is nodes.Func:
+            return self.compile_func(item)
 
-    def ast_func(self, item):
-        self.logger.debug("ast_func:")
-        self.logger.debug(pprint.pformat(item))
+        self.logger.critical("ast_if_cond: internal error!")
+        exit(1)
+
+    def compile_func(self, item):
+        name = item.name
+        line = item.lineno
+        file = item.file
 
         args = list()
 
-        for arg in item[2]:
-            if arg[0] == "string":
-                r = self.ast_string(arg)
-            elif arg[0] == "val":
-                r, _ = self.ast_val(arg)
-            elif arg[0] == "func":
-                r = self.ast_func(arg)
+        for arg in item.args:
+            cls = arg.__class__
+            if cls is nodes.String:
+                args.append(self.compile_string(arg))
+            elif cls is nodes.Val:
+                args.append(self.compile_val(arg))
+            elif cls is nodes.Func:
+                func = self.compile_func(arg)
+                args.append(lambda func=func: str(func()))
             else:
                 self.logger.critical("ast_func: internal error!")
                 exit(1)
 
-            args.append(str(r))
+        args = tuple(args)
+        descriptor = functions.get(name)
 
-        line = item[3][0]
-        file = item[3][1]
+        if descriptor is None:
 
-        r = ""
+            def run():
+                for arg in args:
+                    arg()
+                self.logger.error(
+                    "Function '{name}' not found on {file}:{line}".format(
+                        name=name, file=file, line=line
+                    )
+                )
+                self.num_errors += 1
+                return ""
+
+            return run
+
+        def run():
+            return descriptor.call(self, [arg() for arg in args], line, file)
+
+        return run
+
+    # Node class -> compile method for root level items
+    compile_methods = {
+        nodes.Define: compile_define,
+        nodes.Comment: compile_comment,
+        nodes.Config: compile_config,
+        nodes.Func: compile_func,
+        nodes.If: compile_if,
+    }
+
+    # Prefetching
+    #
+    # With jobs > 1 %(shell) and %(process) calls, whose args are made of
+    # strings and vars only, are started before their step is reached:
+    # shells on thread pool, sub processing on process pool of MCPShared.
+    # Call is started right after the last preceding step that can change
+    # its vars or that has side effects (anything except pure functions,
+    # shell and process). Functions take results in program order and
+    # report them as usual. Shell commands and sub processing themselves
+    # should not depend on each other.
+
+    # vars every shell call depends on, see shellKey()
+    shell_vars = tuple(
+        ("LOCAL_SHELL_CACHE", "LOCAL_SHELL_CACHE_ENV", "LOCAL_SHELL_CACHE_INPUTS")
+    )
+
+    # functions that can be started ahead
+    prefetch_functions = tuple(("shell", "process"))
+
+    def prefetchPlan(self, items):
+        """Returns {step number: [(name, args, line, file)...]} of calls to start."""
+        plan = dict()
+        # step number -> assigned vars, None for side effects
+        changes = list()
+
+        for number, item in enumerate(items):
+            calls = list()
+            changes.append(self.prefetchScan(item, calls))
+
+            if changes[number] is None:
+                continue
 
-        if item[1] == "process":
-            r = self.func_process(args, line, file)
-        elif item[1] == "format":
-            r = self.func_format(args, line, file)
-        elif item[1] == "shell":
-            r = self.func_shell(args, line, file)
-        elif item[1] == "strip":
-            r = self.func_strip(args, line, file)
-        elif item[1] == "diff":
-            r = self.func_diff(args, line, file)
-        elif item[1] == "call":
-            r = self.func_call(args, line, file)
-        elif item[1] == "file":
-            r = self.func_file(args, line, file)
-        elif item[1] == "save":
-            r = self.func_save(args, line, file)
-        elif item[1] == "fail":
-            r = self.func_fail(args, line, file)
-        elif item[1] == "comment":
-            r = self.func_comment(args, line, file)
-        elif item[1] == "major":
-            r = self.func_major(args, line, file)
-        elif item[1] == "minor":
-            r = self.func_minor(args, line, file)
-        elif item[1] == "patch":
-            r = self.func_patch(args, line, file)
-        elif item[1] == "relpath":
-            r = self.func_relpath(args, line, file)
+            for name, args, deps, line, file in calls:
+                # first step that can't change deps anymore
+                start = 0
+                for prev in range(number - 1, -1, -1):
+                    if changes[prev] is None or not changes[prev].isdisjoint(deps):
+                        start = prev + 1
+                        break
+                if start < number:
+                    plan.setdefault(start, list()).append(tuple((name, args, line, file)))
+
+        return plan
+
+    # Collects calls of item that are run each time item is, returns set of
+    # vars that item can assign or None if item has side effects
+    def prefetchScan(self, item, calls):
+        cls = item.__class__
+        assigned = set()
+
+        if cls is nodes.Config:
+            assigned.add(item.name)
+            exprs = [item.value]
+        elif cls is nodes.Func:
+            exprs = [item]
+        elif cls is nodes.If:
+            exprs = [item.left, item.right]
+            for branch in (item.true, item.false):
+                for sub in branch:
+                    sub_assigned = self.prefetchScan(sub, list())
+                    if sub_assigned is None:
+                        return None
+                    assigned |= sub_assigned
+        elif cls is nodes.Include:
+            for sub in item.items or ():
+                sub_assigned = self.prefetchScan(sub, calls)
+                if sub_assigned is None:
+                    return None
+                assigned |= sub_assigned
+            return assigned
         else:
-            self.logger.error(
-                "Function '{name}' not found on {file}:{line}".format(
-                    name=item[1], file=file, line=line
-                )
-            )
-            self.num_errors += 1
+            return assigned
+
+        for expr in exprs:
+            if not self.prefetchScanExpr(expr, calls):
+                return None
+
+        return assigned
+
+    # False if expr calls something except pure functions, shell and process
+    def prefetchScanExpr(self, expr, calls):
+        cls = expr.__class__
+        if cls is nodes.String:
+            for part in expr.parts:
+                if not self.prefetchScanExpr(part, calls):
+                    return False
+        elif cls is nodes.Func:
+            for arg in expr.args:
+                if not self.prefetchScanExpr(arg, calls):
+                    return False
+
+            if expr.name in self.prefetch_functions:
+                args = list()
+                # sub processing doesn't see vars of this run
+                deps = set(self.shell_vars) if expr.name == "shell" else set()
+                for arg in expr.args:
+                    fn = self.compile_prefetch_arg(arg, deps)
+                    if fn is None:
+                        return True
+                    args.append(fn)
+                calls.append(tuple((expr.name, tuple(args), deps, expr.lineno, expr.file)))
+                return True
+
+            descriptor = functions.get(expr.name)
+            if descriptor is None or not descriptor.pure:
+                return False
+
+        return True
+
+    # Arg evaluator for prefetch, returns None if arg isn't just strings
+    # and vars. Evaluator doesn't report anything and returns None if some
+    # var doesn't exist (function will report it).
+    def compile_prefetch_arg(self, arg, deps):
+        if arg.__class__ is nodes.Val:
+            parts = [arg]
+        elif arg.__class__ is nodes.String:
+            parts = arg.parts
+        else:
+            return None
+
+        getters = list()
+        for part in parts:
+            if part.__class__ is nodes.Str:
+                getters.append(lambda value=part.value: value)
+            elif part.__class__ is nodes.Val:
+                deps.add(part.name)
+                getters.append(lambda name=part.name: self.prefetchVar(name))
+            else:
+                return None
+
+        def run():
+            r = ""
+            for getter in getters:
+                value = getter()
+                if value is None:
+                    return None
+                r += value
+            return r
+
+        return run
+
+    def prefetchVar(self, name):
+        item = self.configs.get(name)
+        if item is None:
+            return None
+        return str(item[2][-1][1])
+
+    def prefetch(self, calls):
+        for name, getters, line, file in calls:
+            args = list()
+            for getter in getters:
+                arg = getter()
+                if arg is None:
+                    break
+                args.append(arg)
+            else:
+                if name == "shell":
+                    self.shellPrefetch(args, file)
+                else:
+                    self.processPrefetch(args, line, file)
+
+    # Started call of function name with key, None if there is no one
+    def prefetchTake(self, name, key):
+        futures = self.prefetched.get(tuple((name, key)))
+        if futures:
+            return futures.pop(0)
+        return None
+
+    def shellPrefetch(self, args, file):
+        # same checks as in func_shell, failed calls aren't started
+        if len(args) < 1 or args[0].strip() == "":
+            return
+        key = self.shellKey(args, file)
+        if key is not None:
+            if key in self.shellkeys or self.shellcache.contains(key):
+                return
+            self.shellkeys.add(key)
+
+        if self.shellpool is None:
+            self.shellpool = ThreadPoolExecutor(max_workers=self.jobs)
+        self.logger.debug("Shell '%s' started ahead", args[0])
+        future = self.shellpool.submit(self.shellExec, args)
+        self.prefetched.setdefault(tuple(("shell", tuple(args))), list()).append(future)
+
+    def shellRun(self, args):
+        future = self.prefetchTake("shell", tuple(args))
+        if future is not None:
+            return future.result()
+        return self.shellExec(args)
+
+    def processPrefetch(self, args, line, file):
+        key = self.processKey(args, file)
+        # identical calls after the first one take memoized result
+        if key in self.shared.processes or self.prefetched.get(tuple(("process", key))):
+            return
 
+        pool = self.shared.processPool(self.jobs)
+        if pool is None:
+            return
+        self.logger.debug("Sub processing started ahead")
+        future = pool.submit(processWorker, args, line, file)
+        self.prefetched.setdefault(tuple(("process", key)), list()).append(future)
+
+    # Reports result of sub processing done by processWorker() as if it
+    # was done here
+    def processReplay(self, args, file, result):
+        r, records, num_errors, hits, misses, outputs, manifest = result
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        self.num_errors += num_errors
+        self.shellcache.hits += hits
+        self.shellcache.misses += misses
+        for path, written in outputs.items():
+            self.outputAdd(path, written)
+        self.shared.manifest.update(manifest)
+
+        if r is not None:
+            self.shared.processes[self.processKey(args, file)] = r
         return r
 
+    @staticmethod
+    def shellExec(args):
+        return subprocess.run(args, timeout=5, stdout=PIPE, stderr=PIPE, check=False)
+
+    # same as shellExec(), but doesn't block event loop
+    @staticmethod
+    async def shellExecAsync(args):
+        proc = await asyncio.create_subprocess_exec(*args, stdout=PIPE, stderr=PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=5)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(args, 5)
+        return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+    def checkpoint(self):
+        """Returns state of finished process() that can be pickled.
+
+        Defines are kept as nodes, restore() compiles them again.
+        """
+        return dict(
+            configs=self.configs,
+            definitions=self.definitions,
+            num_errors=self.num_errors,
+            processes=self.shared.processes,
+        )
+
+    # Brings back state returned by checkpoint(), next process() goes on
+    # from it
+    def restore(self, state):
+        self.configs = state["configs"]
+        self.num_errors = state["num_errors"]
+        self.definitions = dict(state["definitions"])
+        self.defines = dict()
+        for name, item in self.definitions.items():
+            self.defines[name] = self.compile(item.body)
+        self.shared.processes.update(state["processes"])
+
     def process(self, ast):
-        self.ast_root(ast)
+        try:
+            self.compile(ast)()
+        finally:
+            if self.shellpool is not None:
+                self.shellpool.shutdown(wait=True)
+                self.shellpool = None
+            self.prefetched.clear()
+            self.shellkeys.clear()
+            if self.owner:
+                self.shared.shutdown()
+        self.configs.compact()
+        self.configs.materialize()
+
+    # Async compiling
+    #
+    # Same closures, but functions with async variant in registry are awaited.
+    # Only steps and expressions with such functions become coroutines, the
+    # rest is compiled as usual. Async args of a function (or parts of a
+    # string, or both if conditions) wait at once, unless some of them has
+    # side effects except shell (then they are run one by one as usual).
+
+    async def process_async(self, ast):
+        await self.compile_async(ast)()
+        self.configs.compact()
+        self.configs.materialize()
+
+    def compile_async(self, items):
+        self.logger.debug("compile_async:")
+
+        steps = list()
+        if items != None:
+            self.compile_items_async(items, steps)
+        steps = tuple(steps)
+
+        async def run():
+            for step, wait in steps:
+                if wait:
+                    await step()
+                else:
+                    step()
+
+        return run
+
+    # steps - (closure, is coroutine) pairs
+    def compile_items_async(self, items, steps):
+        for item in items:
+            cls = item.__class__
+            if cls is nodes.Include:
+                if item.items is not None:
+                    self.compile_items_async(item.items, steps)
+            elif cls is nodes.Define:
+                body = self.compile_async(item.body)
+                steps.append(tuple((self.compile_define(item, body), False)))
+            elif not self.waits(item):
+                steps.append(tuple((self.compile_item(item), False)))
+            elif cls is nodes.Config:
+                value = self.compile_expr_async(item.value)
+                assign = self.compile_assign(item.name, item.op, item.lineno, item.file)
+
+                async def run(value=value, assign=assign):
+                    assign(await value(), "string")
+
+                steps.append(tuple((run, True)))
+            elif cls is nodes.Func:
+                steps.append(tuple((self.compile_expr_async(item), True)))
+            elif cls is nodes.If:
+                steps.append(tuple((self.compile_if_async(item), True)))
+
+    def compile_item(self, item):
+        steps = list()
+        self.compile_items(tuple((item,)), steps, list())
+        return steps[0]
+
+    # True if node (or anything inside) calls function with async variant
+    def waits(self, node):
+        cls = node.__class__
+        if cls is nodes.Config:
+            return self.waits(node.value)
+        elif cls is nodes.String:
+            return any(self.waits(part) for part in node.parts)
+        elif cls is nodes.Func:
+            descriptor = functions.get(node.name)
+            if descriptor is not None and descriptor.coroutine is not None:
+                return True
+            return any(self.waits(arg) for arg in node.args)
+        elif cls is nodes.If:
+            for sub in (node.left, node.right) + tuple(node.true) + tuple(node.false):
+                if self.waits(sub):
+                    return True
+        elif cls is nodes.Include:
+            return any(self.waits(sub) for sub in node.items or ())
+        elif cls is nodes.Define:
+            # define bodies are run by async %(call)
+            return True
+        return False
+
+    # True if node calls function with side effects except shell
+    def ordered(self, node):
+        cls = node.__class__
+        if cls is nodes.String:
+            return any(self.ordered(part) for part in node.parts)
+        elif cls is nodes.Func:
+            descriptor = functions.get(node.name)
+            if descriptor is None or (descriptor.side_effects and node.name != "shell"):
+                return True
+            return any(self.ordered(arg) for arg in node.args)
+        return False
+
+    # Returns (closure, is coroutine) for String, Val or Func
+    def compile_part_async(self, node):
+        cls = node.__class__
+        if cls is nodes.Str:
+            return tuple((lambda value=node.value: value, False))
+        elif cls is nodes.Val:
+            return tuple((self.compile_val(node), False))
+        elif not self.waits(node):
+            if cls is nodes.String:
+                return tuple((self.compile_string(node), False))
+            return tuple((self.compile_func(node), False))
+        return tuple((self.compile_expr_async(node), True))
+
+    async def evaluate(self, parts, ordered):
+        if ordered:
+            r = list()
+            for part, wait in parts:
+                r.append(await part() if wait else part())
+            return r
+
+        # start all waits first, they run while the rest is evaluated
+        waits = [asyncio.ensure_future(part()) if wait else None for part, wait in parts]
+        r = [None if wait else part() for part, wait in parts]
+        for number, future in enumerate(waits):
+            if future is not None:
+                r[number] = await future
+        return r
+
+    # Coroutine for String or Func that waits
+    def compile_expr_async(self, node):
+        if node.__class__ is nodes.String:
+            parts = tuple(self.compile_part_async(part) for part in node.parts)
+            ordered = self.ordered(node)
+
+            async def run():
+                return "".join(await self.evaluate(parts, ordered))
+
+            return run
+
+        name = node.name
+        line = node.lineno
+        file = node.file
+
+        args = list()
+        for arg in node.args:
+            if arg.__class__ not in (nodes.String, nodes.Val, nodes.Func):
+                self.logger.critical("ast_func: internal error!")
+                exit(1)
+            args.append(self.compile_part_async(arg))
+        args = tuple(args)
+        ordered = self.ordered(node)
+        descriptor = functions.get(name)
+
+        async def run():
+            values = [str(value) for value in await self.evaluate(args, ordered)]
+
+            if descriptor is None:
+                self.logger.error(
+                    "Function '{name}' not found on {file}:{line}".format(
+                        name=name, file=file, line=line
+                    )
+                )
+                self.num_errors += 1
+                return ""
+
+            return await descriptor.call_async(self, values, line, file)
+
+        return run
+
+    def compile_if_async(self, item):
+        conds = list()
+        for cond in (item.left, item.right):
+            if cond.__class__ not in (nodes.String, nodes.Val, nodes.Func):
+                self.logger.critical("ast_if_cond: internal error!")
+                exit(1)
+            conds.append(self.compile_part_async(cond))
+        conds = tuple(conds)
+        ordered = self.ordered(item.left) or self.ordered(item.right)
+
+        true = self.compile_async(item.true)
+        false = self.compile_async(item.false)
+
+        if item.kind == "eq":
+            branches = tuple((true, false))
+        elif item.kind == "neq":
+            branches = tuple((false, true))
+        else:
+            self.logger.critical("ast_if: internal error!")
+            exit(1)
+
+        async def run():
+            left, right = await self.evaluate(conds, ordered)
+            if left == right:
+                await branches[0]()
+            else:
+                await branches[1]()
+
+        return run
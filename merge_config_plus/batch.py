@@ -0,0 +1,189 @@
+from .parser import MCPParser
+from .ast import MCPRecords
+from .run import MCPRun
+
+import io
+import os
+import json
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+class MCPBatch:
+    """Many normal mode runs in one process (--batch).
+
+    Manifest is JSON list of jobs, or object with "jobs" list and "args"
+    (command line args added to every job). Job is object with "files"
+    list and optional "output", "prepend", "append" and "args". Relative
+    paths are taken from manifest dir.
+
+    Runs share parser (grammar tables are built once, fragments used by
+    several jobs are parsed once), files and shell caches. With more than
+    one worker jobs are run in forked processes, that start with everything
+    loaded, log and stdout of every job are given back in jobs order.
+    """
+
+    def __init__(self, argparser, path, workers=1):
+        self.logger = logging.getLogger("mcp")
+        self.argparser = argparser
+        self.path = path
+        self.workers = workers
+        self.parser = MCPParser()
+
+    # Returns command line args of every job
+    def load(self):
+        with open(self.path, "r") as f:
+            manifest = json.load(f)
+
+        if isinstance(manifest, list):
+            manifest = dict(jobs=manifest)
+
+        base_dir = os.path.dirname(os.path.abspath(self.path))
+        path = lambda name: os.path.join(base_dir, name)
+
+        r = list()
+        for job in manifest["jobs"]:
+            argv = list(manifest.get("args", list()))
+            argv.extend(job.get("args", list()))
+            argv.extend(["-o", path(job["output"]) if job.get("output") else "-"])
+            if job.get("prepend"):
+                argv.extend(["-p", job["prepend"]])
+            if job.get("append"):
+                argv.extend(["-a", job["append"]])
+            argv.append("-f")
+            argv.extend(path(name) for name in job["files"])
+            r.append(argv)
+        return r
+
+    # Returns exit code, number of errors and time of job
+    def job(self, argv, stdout=None):
+        start = time.perf_counter()
+        code = 0
+        run = None
+
+        try:
+            args = self.argparser.parse_args(argv)
+            if args.batch is not None or args.mode != "normal":
+                self.argparser.error("batch job can't set --batch or --mode")
+
+            run = MCPRun(args, argv, parser=self.parser, stdout=stdout)
+            run.read()
+            code = run.run()
+        except SystemExit as e:
+            # argparse errors and internal errors of run
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            self.logger.exception("Batch job failed: {msg}".format(msg=e))
+            code = 1
+
+        num_errors = run.num_errors if run is not None else 0
+        return tuple((code, num_errors, time.perf_counter() - start))
+
+    def run(self):
+        try:
+            jobs = self.load()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.error(
+                "Can't load batch manifest '{path}': {msg}".format(path=self.path, msg=e)
+            )
+            return 1
+
+        start = time.perf_counter()
+
+        pool = None
+        if self.workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=batchWorkerInit,
+                initargs=(self, self.logger.getEffectiveLevel()),
+            )
+
+        failed = 0
+        try:
+            if pool is None:
+                results = (self.job(argv) for argv in jobs)
+            else:
+                futures = [pool.submit(batchWorker, argv) for argv in jobs]
+                results = (self.replay(future.result()) for future in futures)
+
+            for number, (argv, result) in enumerate(zip(jobs, results)):
+                if not self.report(number, len(jobs), argv, result):
+                    failed += 1
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+        elapsed = time.perf_counter() - start
+        self.logger.info(
+            "Batch: {num} jobs, {failed} failed in {elapsed:.2f}s ({rate:.1f} jobs/s)".format(
+                num=len(jobs),
+                failed=failed,
+                elapsed=elapsed,
+                rate=len(jobs) / elapsed if elapsed > 0 else 0,
+            )
+        )
+
+        return 1 if failed > 0 else 0
+
+    # Gives back log and stdout of job done by batchWorker()
+    def replay(self, result):
+        code, num_errors, elapsed, records, stdout = result
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        if stdout:
+            print(stdout, end="")
+        return tuple((code, num_errors, elapsed))
+
+    # Returns True if job succeeded
+    def report(self, number, total, argv, result):
+        code, num_errors, elapsed = result
+        output = argv[argv.index("-o") + 1] if "-o" in argv else "-"
+
+        if code == 0:
+            self.logger.info(
+                "Job {number}/{total} '{output}' done in {elapsed:.2f}s".format(
+                    number=number + 1, total=total, output=output, elapsed=elapsed
+                )
+            )
+            return True
+
+        self.logger.warning(
+            "Job {number}/{total} '{output}' failed with code {code}, {num} errors".format(
+                number=number + 1, total=total, output=output, code=code, num=num_errors
+            )
+        )
+        return False
+
+
+# MCPBatch and log handler of batch pool worker
+worker = None
+
+
+def batchWorkerInit(batch, level):
+    global worker
+
+    handler = MCPRecords()
+    logger = logging.getLogger("mcp")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(level)
+
+    worker = tuple((batch, handler))
+
+
+def batchWorker(argv):
+    """Runs batch job in pool worker.
+
+    Returns exit code, number of errors, time, log records and stdout,
+    see MCPBatch.replay().
+    """
+    batch, handler = worker
+    handler.records = list()
+    stdout = io.StringIO()
+
+    code, num_errors, elapsed = batch.job(argv, stdout=stdout)
+
+    return tuple((code, num_errors, elapsed, handler.records, stdout.getvalue()))
@@ -0,0 +1,331 @@
+from .files import files
+
+import os
+import sys
+import hashlib
+import locale
+import pickle
+import tempfile
+import logging
+
+
+def cache_dir():
+    """Returns cache directory or None if caching is disabled.
+
+    MCP_CACHE_DIR overrides default location, empty value disables caching.
+    """
+    path = os.environ.get("MCP_CACHE_DIR")
+    if path is not None:
+        return path or None
+
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "merge_config_plus")
+
+
+def package_stamp():
+    """Returns names, sizes and mtimes of package .py files."""
+    r = list()
+    package = os.path.dirname(os.path.abspath(__file__))
+    for root, dirs, names in os.walk(package):
+        dirs.sort()
+        for name in sorted(names):
+            if name.endswith(".py"):
+                st = os.stat(os.path.join(root, name))
+                r.append(
+                    "\0{name}:{size}:{mtime}".format(
+                        name=name, size=st.st_size, mtime=st.st_mtime_ns
+                    )
+                )
+    return "".join(r)
+
+
+class MCPCache:
+    """Pickle based on-disk cache, one file per key.
+
+    Any problem with cache (no permissions, broken file, etc.) is treated
+    as cache miss, caller should always be able to rebuild data.
+    """
+
+    # single - keep only last stored key, for data that has one valid
+    # version at a time, budget - max bytes of entries, least recently used
+    # ones are removed above it
+    def __init__(self, name, path=None, single=False, budget=None):
+        self.logger = logging.getLogger("mcp.cache")
+        self.name = name
+        self.dir = path
+        self.single = single
+        self.budget = budget
+
+    def path(self, key):
+        path = self.dir or cache_dir()
+        if path is None:
+            return None
+        return os.path.join(path, "{name}-{key}.pickle".format(name=self.name, key=key))
+
+    def load(self, key):
+        path = self.path(key)
+        if path is None:
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.debug("Can't load '%s' from cache: %s", path, e)
+            return None
+
+        if self.budget is not None:
+            # mtime is time of last use for evict()
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+        self.logger.debug("'%s' loaded from cache", path)
+        return data
+
+    def store(self, key, data):
+        path = self.path(key)
+        if path is None:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except Exception as e:
+            self.logger.debug("Can't store '%s' to cache: %s", path, e)
+            return
+
+        self.logger.debug("'%s' stored to cache", path)
+
+        if self.single:
+            self.prune(path)
+        elif self.budget is not None:
+            self.evict(path)
+
+    def prune(self, keep):
+        """Removes all entries except keep path."""
+        path = os.path.dirname(keep)
+        prefix = self.name + "-"
+        try:
+            for entry in os.listdir(path):
+                if entry.startswith(prefix) and entry.endswith(".pickle"):
+                    if os.path.join(path, entry) != keep:
+                        os.unlink(os.path.join(path, entry))
+        except OSError as e:
+            self.logger.debug("Can't prune '%s' cache: %s", self.name, e)
+
+    def evict(self, keep):
+        """Removes least recently used entries above budget, except keep path."""
+        path = os.path.dirname(keep)
+        prefix = self.name + "-"
+        entries = list()
+        try:
+            for entry in os.scandir(path):
+                if entry.name.startswith(prefix) and entry.name.endswith(".pickle"):
+                    st = entry.stat()
+                    entries.append(tuple((st.st_mtime_ns, st.st_size, entry.path)))
+        except OSError as e:
+            self.logger.debug("Can't evict '%s' cache: %s", self.name, e)
+            return
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, entry_path in sorted(entries):
+            if size <= self.budget:
+                break
+            if entry_path == keep:
+                continue
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                # removed by another process
+                pass
+            except OSError as e:
+                self.logger.debug("Can't evict '%s' cache: %s", self.name, e)
+                return
+            size -= entry_size
+            self.logger.debug("'%s' evicted from cache", entry_path)
+
+
+class MCPShellCache(MCPCache):
+    """Cache of %(shell ...) stdout.
+
+    Key covers argv, current dir, whitelisted environment vars and
+    content of declared input files. Only successful runs are stored,
+    least recently used results are removed above budget bytes.
+    """
+
+    def __init__(self, path=None, budget=64 << 20):
+        super().__init__("shell", path, budget=budget)
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+
+    # env - names of environment vars to take into account,
+    # inputs - absolute paths of files command depends on
+    def key(self, args, env, inputs):
+        h = hashlib.sha256()
+        h.update(repr(tuple(args)).encode())
+        h.update(b"\0" + os.getcwd().encode())
+
+        for name in sorted(set(env)):
+            value = os.environ.get(name)
+            h.update("\0{name}={value!r}".format(name=name, value=value).encode())
+
+        for path in inputs:
+            h.update(b"\0" + path.encode() + b"\0")
+            try:
+                with open(path, "rb") as f:
+                    h.update(hashlib.sha256(f.read()).digest())
+            except OSError:
+                # missing file is also a state
+                h.update(b"-")
+
+        return h.hexdigest()
+
+    def load(self, key):
+        r = super().load(key)
+        if r is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return r
+
+    def contains(self, key):
+        path = self.path(key)
+        return path is not None and os.path.isfile(path)
+
+
+class MCPManifest:
+    """What run depended on besides its command line and input files.
+
+    Texts of included and %(file) files and inputs of %(shell) calls,
+    also %(save) files run left. Uncached %(shell) call (no
+    LOCAL_SHELL_CACHE=y) can return anything next time, run with it is
+    volatile and isn't stored by MCPRunCache.
+    """
+
+    def __init__(self):
+        # path -> text
+        self.files = dict()
+        # (args, env names, input paths) -> shell cache key
+        self.shells = dict()
+        self.volatile = False
+        # absolute path -> saved text
+        self.saved = dict()
+
+    def update(self, other):
+        self.files.update(other.files)
+        self.shells.update(other.shells)
+        self.volatile = self.volatile or other.volatile
+        self.saved.update(other.saved)
+
+
+class MCPRunCache(MCPCache):
+    """Results of whole runs, the way ccache does it.
+
+    Entry is found by command line, current dir, texts of input files and
+    package code. It keeps digests of all other files run read and keys of
+    its %(shell) calls, and is used only if they are still the same: then
+    stored output, %(save) files and log records are given back without
+    lexing, parsing and processing. Only runs without errors are stored.
+
+    The same way state after the first input files is kept for --checkpoint
+    (with "checkpoint" name). Least recently used entries are removed when
+    entries of the name exceed budget bytes.
+    """
+
+    def __init__(self, path=None, name="run", budget=256 << 20):
+        super().__init__(name, path, budget=budget)
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(text):
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    # argv - command line without program name, texts - content of input files
+    def key(self, argv, texts):
+        if not self.enabled:
+            return None
+
+        h = hashlib.sha256()
+        h.update(repr(tuple(argv)).encode())
+        h.update(b"\0" + os.getcwd().encode())
+        h.update(b"\0" + locale.getpreferredencoding(False).encode())
+        h.update(b"\0" + sys.version.encode())
+
+        # changed package code gives new results, checked like ccache
+        # checks compiler
+        h.update(package_stamp().encode())
+
+        for text in texts:
+            h.update(b"\0" + hashlib.sha256(text.encode()).digest())
+
+        return h.hexdigest()
+
+    # manifest - MCPManifest of run, result - what has to be given back
+    def store(self, key, manifest, result):
+        if key is None or manifest.volatile:
+            return
+
+        entry = dict(result)
+        entry["files"] = {path: self.digest(text) for path, text in manifest.files.items()}
+        entry["shells"] = manifest.shells
+        entry["saved"] = manifest.saved
+        super().store(key, entry)
+
+    # Returns stored result if entry is still valid, None otherwise
+    def load(self, key, shellcache):
+        if key is None:
+            return None
+
+        entry = super().load(key)
+        if entry is not None and not self.valid(entry, shellcache):
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    # Manifest of stored run, files are read again (they were just checked)
+    @staticmethod
+    def manifest(entry):
+        r = MCPManifest()
+        for path in entry["files"]:
+            r.files[path] = files.read(path)
+        r.shells.update(entry["shells"])
+        r.saved.update(entry["saved"])
+        return r
+
+    def valid(self, entry, shellcache):
+        for path, digest in entry["files"].items():
+            try:
+                if self.digest(files.read(path)) != digest:
+                    self.logger.debug("'%s' cache entry is outdated by '%s'", self.name, path)
+                    return False
+            except OSError:
+                return False
+
+        for (args, env, inputs), key in entry["shells"].items():
+            if shellcache.key(args, env, inputs) != key:
+                self.logger.debug(
+                    "'%s' cache entry is outdated by '%s' inputs", self.name, args[0]
+                )
+                return False
+
+        return True
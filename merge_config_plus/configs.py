@@ -0,0 +1,174 @@
+class MCPRope:
+    """Lazy string value built by += and =+.
+
+    Prepended and appended chunks are kept in lists shared with ropes it
+    was built from, every rope sees only its own number of them. Extending
+    the newest rope appends to the lists in place, so long accumulations
+    cost linear time. Text is joined on first str() and kept.
+    """
+
+    __slots__ = ("head", "nhead", "tail", "ntail", "text")
+
+    def __init__(self, value=""):
+        # head holds prepended chunks in reverse order
+        self.head = list()
+        self.nhead = 0
+        self.tail = [value]
+        self.ntail = 1
+        self.text = value
+
+    @classmethod
+    def derive(cls, head, nhead, tail, ntail):
+        r = cls.__new__(cls)
+        r.head = head
+        r.nhead = nhead
+        r.tail = tail
+        r.ntail = ntail
+        r.text = None
+        return r
+
+    def append(self, value):
+        tail = self.tail
+        # some newer rope already extended the list
+        if self.ntail != len(tail):
+            tail = tail[: self.ntail]
+        tail.append(value)
+        return self.derive(self.head, self.nhead, tail, self.ntail + 1)
+
+    def prepend(self, value):
+        head = self.head
+        if self.nhead != len(head):
+            head = head[: self.nhead]
+        head.append(value)
+        return self.derive(head, self.nhead + 1, self.tail, self.ntail)
+
+    def __str__(self):
+        if self.text is None:
+            self.text = "".join(reversed(self.head[: self.nhead]))
+            self.text += "".join(self.tail[: self.ntail])
+            # further chunks go to own lists, old ones can be released
+            self.head = list()
+            self.nhead = 0
+            self.tail = [self.text]
+            self.ntail = 1
+        return self.text
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __eq__(self, other):
+        if other.__class__ is MCPRope:
+            other = str(other)
+        return str(self) == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+class MCPWas:
+    """Tombstone left in place of a reassigned config.
+
+    Rendered lazily as ' NAME was 'VALUE'' comment, VALUE is the value
+    that replaced it.
+    """
+
+    __slots__ = ("name", "value")
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def item(self):
+        return tuple(("comment", " " + self.name + " was '" + str(self.value) + "'"))
+
+
+class MCPConfigs:
+    """Ordered config store.
+
+    Items are kept in insertion order in a dict keyed by sequence number,
+    so moving an item to the end or dropping it is O(1). A second dict
+    maps config name to the sequence number of its live item.
+
+    Iteration yields the same tuples as before:
+    ("config", name, values) and ("comment", text).
+    """
+
+    def __init__(self):
+        self.slots = dict()
+        self.index = dict()
+        self.seq = 0
+        self.holes = 0
+
+    def __iter__(self):
+        for item in self.slots.values():
+            if item.__class__ is MCPWas:
+                yield item.item()
+            else:
+                yield item
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get(self, name):
+        seq = self.index.get(name)
+        if seq is None:
+            return None
+        return self.slots[seq]
+
+    def append(self, item):
+        self.slots[self.seq] = item
+        if item[0] == "config":
+            self.index[item[1]] = self.seq
+        self.seq += 1
+
+    def move(self, name, value=None, tombstone=True):
+        """Moves live config to the end.
+
+        If tombstone is set old place keeps 'was' comment with value,
+        otherwise old place is dropped.
+        """
+        seq = self.index[name]
+        item = self.slots[seq]
+
+        if tombstone:
+            self.slots[seq] = MCPWas(name, value)
+        else:
+            del self.slots[seq]
+            self.holes += 1
+
+        self.append(item)
+
+        return item
+
+    def compact(self):
+        """Renumbers slots, dropping space left by removed items."""
+        if self.holes == 0:
+            return
+
+        slots = dict()
+        index = dict()
+        for seq, item in enumerate(self.slots.values()):
+            slots[seq] = item
+            if item.__class__ is not MCPWas and item[0] == "config":
+                index[item[1]] = seq
+
+        self.slots = slots
+        self.index = index
+        self.seq = len(slots)
+        self.holes = 0
+
+    def materialize(self):
+        """Replaces lazy (MCPRope) values with str."""
+        for item in self.slots.values():
+            if item.__class__ is MCPWas:
+                if item.value.__class__ is MCPRope:
+                    item.value = str(item.value)
+                continue
+
+            if item[0] != "config":
+                continue
+
+            values = item[2]
+            for i, value in enumerate(values):
+                if value[1].__class__ is MCPRope:
+                    values[i] = tuple((value[0], str(value[1]), value[2], value[3]))
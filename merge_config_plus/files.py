@@ -0,0 +1,196 @@
+import os
+import errno
+import stat
+import itertools
+import mmap
+import locale
+import threading
+import collections
+import time
+import logging
+
+
+class MCPFiles:
+    """Decoded content of read files, shared by includes and %(file).
+
+    Entry is valid while file keeps its device, inode, size, mtime and
+    ctime, so every read costs one stat() if file wasn't changed. Only
+    regular non empty files are kept (not /proc entries, pipes, etc.),
+    files changed less than racy seconds before read aren't kept too, as
+    next change can leave the same mtime. Least recently used entries are
+    dropped when content exceeds budget bytes.
+
+    Files from mmap_min bytes are decoded straight from memory map instead
+    of read() copy, None disables it. Text is decoded as open(path, "r")
+    does it. Every handle is closed before read() returns.
+    """
+
+    racy = 2
+
+    def __init__(self, budget=64 << 20, mmap_min=1 << 20):
+        self.logger = logging.getLogger("mcp.files")
+        self.budget = budget
+        self.mmap_min = mmap_min
+        # path -> (stat key, text)
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.temps = itertools.count()
+        # %(file) is read from executor threads by async evaluator
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(st):
+        return tuple((st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns))
+
+    def read(self, path):
+        """Returns text of file, raises the same errors as open()."""
+        with self.lock:
+            entry = self.entries.get(path)
+
+        if entry is not None:
+            try:
+                valid = self.key(os.stat(path)) == entry[0]
+            except OSError:
+                valid = False
+            if valid:
+                with self.lock:
+                    if path in self.entries:
+                        self.entries.move_to_end(path)
+                    self.hits += 1
+                self.logger.debug("'%s' taken from files cache", path)
+                return entry[1]
+
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if self.mmap_min is not None and st.st_size >= self.mmap_min:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    text = self.decode(m)
+            else:
+                text = self.decode(f.read())
+
+        with self.lock:
+            self.misses += 1
+            self.store(path, st, text)
+
+        return text
+
+    # Same text as open(path, "r").read() gives
+    @staticmethod
+    def decode(data):
+        text = str(data, locale.getpreferredencoding(False))
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
+
+    def store(self, path, st, text):
+        old = self.entries.pop(path, None)
+        if old is not None:
+            self.size -= len(old[1])
+
+        if not stat.S_ISREG(st.st_mode) or st.st_size == 0 or len(text) > self.budget:
+            return
+        if time.time_ns() - st.st_mtime_ns < self.racy * 1000000000:
+            return
+
+        self.entries[path] = tuple((self.key(st), text))
+        self.size += len(text)
+
+        while self.size > self.budget:
+            _, (_, dropped) = self.entries.popitem(last=False)
+            self.size -= len(dropped)
+
+    def write(self, path, text):
+        """Replaces content of file with text if it differs.
+
+        Returns True if file was written. New content goes to temp file in
+        the same dir, that is renamed over the old one, so readers never
+        see partial file. Mode of existing file is kept, symlinks are
+        followed. Raises the same errors as open(path, "w") would.
+        """
+        path = os.path.realpath(path)
+        if os.linesep != "\n":
+            text = text.replace("\n", os.linesep)
+        data = text.encode(locale.getpreferredencoding(False))
+
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+
+        if st is not None:
+            if stat.S_ISDIR(st.st_mode):
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+            if not os.access(path, os.W_OK):
+                raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), path)
+            if stat.S_ISREG(st.st_mode) and st.st_size == len(data):
+                with open(path, "rb") as f:
+                    if f.read() == data:
+                        return False
+
+        dir = os.path.dirname(path)
+        while True:
+            tmp = os.path.join(
+                dir,
+                ".{name}.{pid}-{n}.tmp".format(
+                    name=os.path.basename(path), pid=os.getpid(), n=next(self.temps)
+                ),
+            )
+            try:
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+                break
+            except FileExistsError:
+                continue
+            except OSError as e:
+                # report target, not temp file
+                raise type(e)(e.errno, e.strerror, path)
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            if st is not None:
+                os.chmod(tmp, stat.S_IMODE(st.st_mode))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+
+        return True
+
+    def sweep(self):
+        """Drops entries of changed or removed files, returns their number.
+
+        Every read validates entry anyway, long running process (--serve)
+        calls it between runs so memory isn't held by stale content.
+        """
+        with self.lock:
+            paths = list(self.entries)
+
+        dropped = 0
+        for path in paths:
+            try:
+                key = self.key(os.stat(path))
+            except OSError:
+                key = None
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry is not None and entry[0] != key:
+                    del self.entries[path]
+                    self.size -= len(entry[1])
+                    dropped += 1
+        return dropped
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# shared by all lexers and MCPAst instances
+files = MCPFiles()
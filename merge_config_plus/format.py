@@ -1,4 +1,7 @@
+from .functions import MCPMemo
+
 import os
+import string
 
 
 class MCPFormat:
@@ -84,3 +87,109 @@ class MCPFormat:
             return "{name}={value}".format(name=name, value=hex(value).upper())
         else:
             return "{value}".format(value=hex(value).upper())
+
+
+class MCPTemplate:
+    """Template of %(format), parsed once with string.Formatter.
+
+    Named fields ({name}, {name!r}, {name:>8}) are rendered in one pass,
+    missing vars are left as {name} and returned to caller. Other templates
+    (positional, nested or indexed fields, malformed ones) are rendered
+    with str.format() as before.
+    """
+
+    # template text -> MCPTemplate
+    compiled = MCPMemo(size=256)
+
+    # vars text -> (vars, lines that aren't 'name=value')
+    parsed = MCPMemo(size=256)
+
+    conversions = {"r": repr, "s": str, "a": ascii}
+
+    @classmethod
+    def get(cls, text):
+        r = cls.compiled.get(text)
+        if r is None:
+            r = cls(text)
+            cls.compiled.put(text, r)
+        return r
+
+    @classmethod
+    def vars(cls, raw):
+        """Returns vars dict and bad lines of 'name=value' lines text."""
+        r = cls.parsed.get(raw)
+        if r is not None:
+            return r
+
+        vars = dict()
+        bad = list()
+        for line in raw.splitlines():
+            splited = line.strip().split("=")
+            if len(splited) != 2:
+                bad.append(line)
+                continue
+            vars[splited[0]] = str(splited[1]).strip()
+
+        r = tuple((vars, tuple(bad)))
+        cls.parsed.put(raw, r)
+        return r
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = self.parse(text)
+
+    # Returns (literal, name, spec, conversion) tuples, None if template
+    # is left to str.format()
+    @classmethod
+    def parse(cls, text):
+        try:
+            fields = list(string.Formatter().parse(text))
+        except ValueError:
+            return None
+
+        for _, name, spec, conversion in fields:
+            if name is None:
+                continue
+            if name == "" or name[0].isdigit() or "." in name or "[" in name:
+                return None
+            if "{" in spec or (conversion is not None and conversion not in cls.conversions):
+                return None
+
+        return tuple(fields)
+
+    def render(self, vars):
+        """Returns rendered text and missing var names in template order."""
+        if self.fields is None:
+            return self.format(vars)
+
+        parts = list()
+        missing = list()
+        for literal, name, spec, conversion in self.fields:
+            parts.append(literal)
+            if name is None:
+                continue
+
+            value = vars.get(name)
+            if value is None:
+                if name not in missing:
+                    missing.append(name)
+                value = "{" + name + "}"
+            if conversion is not None:
+                value = self.conversions[conversion](value)
+            parts.append(format(value, spec))
+
+        return "".join(parts), missing
+
+    def format(self, vars):
+        vars = dict(vars)
+        missing = list()
+        while True:
+            try:
+                return self.text.format(**vars), missing
+            except KeyError as e:
+                name = e.args[0]
+                # missing key of index, not a var
+                if name in vars:
+                    raise
+                missing.append(name)
+                vars[name] = "{" + name + "}"
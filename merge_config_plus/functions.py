@@ -0,0 +1,118 @@
+import os
+import collections
+
+
+class MCPMemo:
+    """Bounded LRU map of function args tuple to result."""
+
+    def __init__(self, size=256):
+        self.size = size
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        r = self.items.get(key)
+        if r is None:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return r
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+
+class MCPFunction:
+    """Descriptor of %(name ...) function.
+
+    method is called as method(ast, args, line, file), args is list of
+    strings. args of descriptor is expected number of args as (min, max),
+    max None means any, functions check and report args themselves.
+
+    pure - result depends only on args (and current dir if cwd is set),
+    such results are memoized while call doesn't report errors.
+    io - function reads files or runs commands.
+    side_effects - function changes processing state or outer world.
+    coroutine - async variant of method for MCPAst.process_async(),
+    set with coroutine() decorator.
+    """
+
+    def __init__(
+        self,
+        name,
+        method,
+        args=(0, None),
+        pure=False,
+        io=False,
+        side_effects=False,
+        cwd=False,
+    ):
+        self.name = name
+        self.method = method
+        self.args = args
+        self.pure = pure
+        self.io = io
+        self.side_effects = side_effects
+        self.cwd = cwd
+        self.memo = MCPMemo() if pure else None
+        self.coroutine = None
+
+    def call(self, ast, args, line, file):
+        if self.memo is None:
+            return self.method(ast, args, line, file)
+
+        key = tuple(args)
+        if self.cwd:
+            key += tuple((os.getcwd(),))
+
+        r = self.memo.get(key)
+        if r is not None:
+            return r
+
+        num_errors = ast.num_errors
+        r = self.method(ast, args, line, file)
+        # failed calls are repeated to report errors again
+        if r is not None and ast.num_errors == num_errors:
+            self.memo.put(key, r)
+
+        return r
+
+    async def call_async(self, ast, args, line, file):
+        if self.coroutine is None:
+            return self.call(ast, args, line, file)
+        return await self.coroutine(ast, args, line, file)
+
+
+# name -> MCPFunction
+functions = dict()
+
+
+def function(name, **kwargs):
+    """Registers decorated callable as %(name ...) function.
+
+    Takes MCPFunction args, registering existing name replaces it.
+    """
+
+    def decorator(method):
+        functions[name] = MCPFunction(name, method, **kwargs)
+        return method
+
+    return decorator
+
+
+def coroutine(name):
+    """Registers decorated coroutine as async variant of %(name ...)."""
+
+    def decorator(method):
+        functions[name].coroutine = method
+        return method
+
+    return decorator
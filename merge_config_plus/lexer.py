@@ -1,10 +1,12 @@
 from .sly import Lexer
+from .cache import MCPCache
+from .log import pformat_lazy
+from .files import files
 
 import re
 import os
 import sys
 import logging
-import pprint
 
 
 class MCPLexer(Lexer):
@@ -30,11 +32,19 @@ class MCPLexer(Lexer):
         STRING,
     }
 
+    # validated token rules are remembered between runs
+    patterncache = MCPCache("lexer", single=True)
+
     def __init__(self):
         self.logger = logging.getLogger("mcp.lexer")
         self.includes = list()
         self.hierarchy = list()
+        # path -> text of included files, see MCPManifest
+        self.reads = dict()
         self.num_errors = 0
+        # include files content in place (tokenize2), otherwise
+        # include tokens are left for parser
+        self.splice = True
 
     def textAdd(self, text, path, comment=""):
         self.includes.append(tuple((text, 1, 0, os.path.abspath(path))))
@@ -63,61 +73,79 @@ class MCPLexer(Lexer):
                 return t  # None
             t.value = os.path.join(os.path.dirname(self.file), t.value)
 
-        # Skip if there will be recusrion
-        if t.value == self.file:
-            self.logger.error("'{file}' is recursive include".format(file=t.value))
-            self.num_errors += 1
-            return t  # None
-        for include in self.includes:
-            if include[3] == t.value:
-                self.logger.error("'{file}' is recursive include:".format(file=t.value))
-                self.num_errors += 1
-                return None
+        # includes are resolved by MCPParser.parse2() after parsing
+        if not self.splice:
+            return t
 
-        if os.path.isfile(t.value):
-            if not self.hierarchyAdd(self.hierarchy, t.value, ""):
-                self.logger.critical("Internal error!")
-                exit(1)
+        r = self.includeCheck(t.value, self.file)
+        if r is None:
+            return None
 
-            data = open(t.value, "r").read()
+        if r:
+            data = self.fileRead(t.value)
             # push current file with position right after include
             self.includes.append(tuple((self.text, self.lineno, self.index, self.file)))
             # push next file, that will be taken by tokenize2
             self.includes.append(tuple((data, 1, 0, t.value)))
             # force end tokenize
             self.index = len(self.text)
+        return t
+
+    # Returns True if path should be included to file, False if include
+    # should be skipped and None if include token should be dropped
+    def includeCheck(self, path, file):
+        # Skip if there will be recusrion
+        if path == file:
+            self.logger.error("'{file}' is recursive include".format(file=path))
+            self.num_errors += 1
+            return False
+        for include in self.includes:
+            if include[3] == path:
+                self.logger.error("'{file}' is recursive include:".format(file=path))
+                self.num_errors += 1
+                return None
+
+        if os.path.isfile(path):
+            if not self.hierarchyAdd(self.hierarchy, path, "", file):
+                self.logger.critical("Internal error!")
+                exit(1)
         else:
-            self.logger.error("'{file}' doesn't exist".format(file=t.value))
+            self.logger.error("'{file}' doesn't exist".format(file=path))
             self.num_errors += 1
-            return t  # None
-        return t
+            return False
+        return True
+
+    def fileRead(self, path):
+        text = files.read(path)
+        self.reads[path] = text
+        return text
 
     @_(r"(\?=|\+=|=\+|-=|=)")
     def ASSIGN(self, t):
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r"[ymn]")
     def STATE(self, t):
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r",")
     def COMMA(self, t):
         t.value = None
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r"\)")
     def CBRACKET(self, t):
         t.value = None
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r"\.")
     def DOT(self, t):
         t.value = None
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     _re_unset = r"\#\s([A-Z][a-zA-Z0-9_]*)\sis\snot\sset"
@@ -125,19 +153,19 @@ class MCPLexer(Lexer):
     @_(_re_unset)
     def UNSET(self, t):
         t.value = re.match(self._re_unset, t.value).group(1)
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r"0[xX][a-fA-F0-9][a-fA-F0-9]*")
     def HEX(self, t):
         t.value = int(t.value, 16)
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r"-?[0-9]+")
     def INT(self, t):
         t.value = int(t.value, 10)
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     _re_var = r"([A-Z][a-zA-Z0-9_]*)"
@@ -145,7 +173,7 @@ class MCPLexer(Lexer):
     @_(_re_var)
     def VAR(self, t):
         t.value = re.match(self._re_var, t.value).group(1)
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     _re_val = r"%\(\s*([A-Z][a-zA-Z0-9_]*)\s*\)"
@@ -153,26 +181,26 @@ class MCPLexer(Lexer):
     @_(_re_val)
     def VAL(self, t):
         t.value = re.match(self._re_val, t.value).group(1)
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r"(\"[^\"]*\"|\'[^\']*\')")
     def STRING(self, t):
         t.value = self.remove_quotes(t.value).replace("\\\n", "").replace("\\n", "\n").replace("\\t", "\t")
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     ### Conditional
     @_(r"%\(\s*else\s*\)")
     def ELSE(self, t):
         t.value = None
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r"%\(\s*endif\s*\)")
     def ENDIF(self, t):
         t.value = None
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     _re_if = r"%\(\s*if(eq|neq)\s*"
@@ -180,7 +208,7 @@ class MCPLexer(Lexer):
     @_(_re_if)
     def IF(self, t):
         t.value = re.match(self._re_if, t.value).group(1)
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     ## Define
@@ -193,13 +221,13 @@ class MCPLexer(Lexer):
             t.value = m.group(2)
         else:
             t.value = m.group(3)
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     @_(r"%\(\s*endef\s*\)")
     def ENDEF(self, t):
         t.value = None
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     ### Function
@@ -208,14 +236,14 @@ class MCPLexer(Lexer):
     @_(_re_func)
     def FUNC(self, t):
         t.value = re.match(self._re_func, t.value).group(1)
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     # Ignore comments from # untill \n
     @_(r"\#(.*)")
     def COMMENT(self, t):
         t.value = t.value[1:]
-        self.logger.debug(pprint.pformat(t))
+        self.logger.debug("%s", pformat_lazy(t))
         return t
 
     # Ignored pattern
@@ -237,24 +265,21 @@ class MCPLexer(Lexer):
             return text[1:-1]
         return text
 
-    def hierarchyAdd(self, hierarchy, target, comment):
+    def hierarchyAdd(self, hierarchy, target, comment, parent):
         for item in hierarchy:
-            if item[0] == self.file:
+            if item[0] == parent:
                 item[1].append(tuple((target, [], comment)))
                 self.logger.debug(
-                    "'{target}' added to '{parent}' hierarchy".format(
-                        target=target, parent=item[0]
-                    )
+                    "'%s' added to '%s' hierarchy", target, item[0]
                 )
                 return True
             else:
-                r = self.hierarchyAdd(item[1], target, comment)
+                r = self.hierarchyAdd(item[1], target, comment, parent)
                 if r:
                     return True
         return False
 
-    # Lexer's tokenize() wrapper
-    def tokenize2(self, prepend="", append=""):
+    def textsPrepare(self, prepend="", append=""):
         if prepend:
             self.logger.debug("Added prepend data")
             self.includes.insert(0, tuple((prepend, 1, 0, "/")))
@@ -263,6 +288,10 @@ class MCPLexer(Lexer):
             self.logger.debug("Added append data")
             self.includes.append(tuple((append, 1, 0, "/")))
 
+    # Lexer's tokenize() wrapper
+    def tokenize2(self, prepend="", append=""):
+        self.textsPrepare(prepend, append)
+
         while len(self.includes) > 0:
             include = self.includes.pop()
             toks = self.tokenize(
@@ -0,0 +1,50 @@
+import logging
+import pprint
+
+
+class CustomFormatter(logging.Formatter):
+    white = "\033[36;1m"
+    grey = "\033[37;1m"
+    yellow = "\033[33;1m"
+    red = "\033[31;1m"
+    bold_red = "\033[41;1m"
+    reset = "\033[0m"
+
+    format = "%(name)s [%(levelname)s]: %(message)s"
+
+    FORMATS = {
+        logging.DEBUG: grey + format + reset,
+        logging.INFO: white + format + reset,
+        logging.WARNING: yellow + format + reset,
+        logging.ERROR: red + format + reset,
+        logging.CRITICAL: bold_red + format + reset,
+    }
+
+    def __init__(self):
+        super().__init__()
+        # formatters are built once, not on every record
+        self.formatters = {
+            level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()
+        }
+
+    def format(self, record):
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
+        return formatter.format(record)
+
+
+class pformat_lazy:
+    """Defers pprint.pformat() until log record is really emitted.
+
+    Use as logger.debug("%s", pformat_lazy(obj)), so disabled debug
+    output costs only logger level check.
+    """
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return pprint.pformat(self.obj)
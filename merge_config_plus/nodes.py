@@ -0,0 +1,130 @@
+import sys
+
+
+class Node:
+    """Base of AST nodes.
+
+    Nodes keep only their fields in __slots__, child lists of finished
+    nodes are tuples. Evaluator dispatches on node class.
+    """
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if self.__class__ is not other.__class__:
+            return NotImplemented
+        for name in self.__slots__:
+            if getattr(self, name) != getattr(other, name):
+                return False
+        return True
+
+    def __repr__(self):
+        return "{cls}({fields})".format(
+            cls=self.__class__.__name__,
+            fields=", ".join(repr(getattr(self, name)) for name in self.__slots__),
+        )
+
+
+class Include(Node):
+    # items - included file nodes, set when include is resolved
+    __slots__ = ("path", "items")
+
+    def __init__(self, path, items=None):
+        self.path = path
+        self.items = items
+
+
+class Comment(Node):
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Config(Node):
+    __slots__ = ("name", "op", "value", "lineno", "file")
+
+    def __init__(self, name, op, value, lineno, file):
+        self.name = sys.intern(name)
+        self.op = op
+        self.value = value
+        self.lineno = lineno
+        self.file = sys.intern(file)
+
+
+class State(Node):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Int(Node):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Hex(Node):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Val(Node):
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = sys.intern(name)
+
+
+class Str(Node):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class String(Node):
+    # parts - Str, Val and Func nodes
+    __slots__ = ("parts",)
+
+    def __init__(self, parts):
+        self.parts = parts
+
+
+class Func(Node):
+    # args - String, Val and Func nodes
+    __slots__ = ("name", "args", "lineno", "file")
+
+    def __init__(self, name, args, lineno, file):
+        self.name = sys.intern(name)
+        self.args = args
+        self.lineno = lineno
+        self.file = sys.intern(file)
+
+
+class If(Node):
+    # kind - "eq" or "neq", left and right - String, Val or Func nodes
+    __slots__ = ("kind", "left", "right", "true", "false")
+
+    def __init__(self, kind, left, right, true, false):
+        self.kind = kind
+        self.left = left
+        self.right = right
+        self.true = true
+        self.false = false
+
+
+class Define(Node):
+    __slots__ = ("name", "body")
+
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+
+
+# States are immutable, all configs share these nodes
+STATES = {value: State(value) for value in ("y", "m", "n")}
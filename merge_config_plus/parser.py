@@ -1,17 +1,41 @@
 from .sly import Parser
 from .lexer import MCPLexer
+from .cache import MCPCache, package_stamp
+from .plain import MCPPlain
+from .functions import MCPMemo
+from .log import pformat_lazy
+from . import nodes
 
+import os
+import hashlib
+import itertools
 import logging
-import pprint
+
+
+# Bump on any change of produced AST nodes, invalidates cached parse results
+# (changed package code does it too, see MCPParser.stamp)
+AST_FORMAT = 2
 
 
 class MCPParser(Parser):
     tokens = MCPLexer.tokens
 
+    # LR tables are built once and loaded from cache on next imports
+    tablecache = MCPCache("parser", single=True)
+    # package code of the process, part of parse results key
+    stamp = None
+
     def __init__(self):
+        if MCPParser.stamp is None:
+            MCPParser.stamp = package_stamp()
         self.logger = logging.getLogger("mcp.parser")
         self.names = {}
         self.num_errors = 0
+        self.plain = MCPPlain()
+        # least recently used parse results are removed above budget
+        self.cache = MCPCache("ast", budget=64 << 20)
+        # recently parsed texts, saves cache loads when parser is reused
+        self.parsed = MCPMemo(size=64)
 
     ### Root rule
     @_("config", "if0", "include", "function", "comment", "define")
@@ -38,24 +62,22 @@ class MCPParser(Parser):
     ### Include
     @_("INCLUDE")
     def include(self, p):
-        r = tuple(("include", str(p[0])))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Include(str(p[0]))
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     ### Comment
     @_("COMMENT")
     def comment(self, p):
-        r = tuple(("comment", str(p[0])))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Comment(str(p[0]))
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     ### Config
     @_("UNSET")
     def config(self, p):
-        r = tuple(
-            ("config", str(p[0]), "=", tuple(("state", "n")), tuple((p.lineno, p.file)))
-        )
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Config(str(p[0]), "=", nodes.STATES["n"], p.lineno, p.file)
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_(
@@ -67,79 +89,80 @@ class MCPParser(Parser):
         "VAR ASSIGN string",
     )
     def config(self, p):
-        r = tuple(("config", str(p[0]), str(p[1]), p[2], tuple((p.lineno, p.file))))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Config(str(p[0]), str(p[1]), p[2], p.lineno, p.file)
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     ### Basic types
     @_("STATE")
     def state(self, p):
-        r = tuple(("state", str(p[0])))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.STATES[str(p[0])]
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_("INT")
     def int(self, p):
-        r = tuple(("int", int(p[0])))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Int(int(p[0]))
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_("HEX")
     def hex(self, p):
-        r = tuple(("hex", int(p[0])))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Hex(int(p[0]))
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_("VAL")
     def val(self, p):
-        r = tuple(("val", str(p[0])))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Val(str(p[0]))
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     ### String
     @_("STRING")
     def str(self, p):
-        r = tuple(("str", str(p[0])))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Str(str(p[0]))
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_("str")
     def string(self, p):
-        r = tuple(("string", [p[0]]))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.String(tuple((p[0],)))
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_("str DOT", "function DOT", "val DOT")
     def string0(self, p):
-        r = tuple(("string", [p[0]]))
+        r = nodes.String([p[0]])
         self.logger.debug("Added to 'string0'")
         return r
 
     @_("string0 str DOT", "string0 function DOT", "string0 val DOT")
     def string0(self, p):
         r = p[0]
-        r[1].append(p[1])
+        r.parts.append(p[1])
         self.logger.debug("Added to 'string0'")
         return r
 
     @_("string0 str", "string0 function", "string0 val")
     def string(self, p):
         r = p[0]
-        r[1].append(p[1])
+        r.parts.append(p[1])
+        r.parts = tuple(r.parts)
         self.logger.debug("Added to 'string'")
         return r
 
     ### Function
     @_("FUNC")
     def function0(self, p):
-        r = tuple(("func", str(p[0]), [], tuple((p.lineno, p.file))))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Func(str(p[0]), [], p.lineno, p.file)
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_("function0 string COMMA", "function0 val COMMA", "function0 function COMMA")
     def function0(self, p):
         r = p[0]
-        r[2].append(p[1])
+        r.args.append(p[1])
         self.logger.debug("Added to 'function0'")
         return r
 
@@ -152,15 +175,16 @@ class MCPParser(Parser):
     def function(self, p):
         r = p[0]
         if len(p) == 3:
-            r[2].append(p[1])
+            r.args.append(p[1])
+        r.args = tuple(r.args)
         self.logger.debug("Added to 'function'")
         return r
 
     ### Conditional
     @_("IF string COMMA", "IF val COMMA", "IF function COMMA")
     def ifcondition0(self, p):
-        r = tuple(("if", str(p[0]), p[1]))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.If(str(p[0]), p[1], None, [], [])
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_(
@@ -169,8 +193,9 @@ class MCPParser(Parser):
         "ifcondition0 function CBRACKET",
     )
     def ifcondition(self, p):
-        r = p[0] + tuple((p[1], [], []))
-        self.logger.debug(pprint.pformat(r))
+        r = p[0]
+        r.right = p[1]
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_(
@@ -184,7 +209,7 @@ class MCPParser(Parser):
     def ifbranch(self, p):
         r = p[0]
         if len(p) == 2:
-            r[4].append(p[1])
+            r.true.append(p[1])
         self.logger.debug("Added to 'ifbranch'")
         return r
 
@@ -199,19 +224,22 @@ class MCPParser(Parser):
     def else0(self, p):
         r = p[0]
         if p[1]:
-            r[5].append(p[1])
+            r.false.append(p[1])
         self.logger.debug("Added to 'else0'")
         return r
 
     @_("else0 ENDIF", "ifbranch ENDIF")
     def if0(self, p):
-        return p[0]
+        r = p[0]
+        r.true = tuple(r.true)
+        r.false = tuple(r.false)
+        return r
 
     ### Define
     @_("DEFINE")
     def define0(self, p):
-        r = tuple(("define", str(p[0]), []))
-        self.logger.debug(pprint.pformat(r))
+        r = nodes.Define(str(p[0]), [])
+        self.logger.debug("%s", pformat_lazy(r))
         return r
 
     @_(
@@ -223,13 +251,15 @@ class MCPParser(Parser):
     )
     def define0(self, p):
         r = p[0]
-        r[2].append(p[1])
+        r.body.append(p[1])
         self.logger.debug("Added to 'define0'")
         return r
 
     @_("define0 ENDEF")
     def define(self, p):
-        return p[0]
+        r = p[0]
+        r.body = tuple(r.body)
+        return r
 
     def error(self, p):
         if p:
@@ -242,3 +272,119 @@ class MCPParser(Parser):
         else:
             self.num_errors += 1
             self.logger.error("Syntax error at EOF")
+
+    # Parser's parse() wrapper, takes texts from lexer (as tokenize2() does).
+    # Every text is parsed on its own, include nodes are resolved after that:
+    # included file is parsed the same way and attached as node's children.
+    # bounds - if set, gets number of items after every text, empty - no
+    # items isn't an error (there were items before, e.g. in checkpoint)
+    def parse2(self, lexer, prepend="", append="", bounds=None, empty=False):
+        lexer.textsPrepare(prepend, append)
+        lexer.splice = False
+
+        r = list()
+
+        while len(lexer.includes) > 0:
+            include = lexer.includes.pop()
+            ast = self.textParse(
+                lexer, include[0], include[3], lineno=include[1], index=include[2]
+            )
+            if ast is None:
+                return None
+            ast = self.includesResolve(lexer, ast, include[3])
+            if ast is None:
+                return None
+            r.extend(ast)
+            if bounds is not None:
+                bounds.append(len(r))
+
+        if len(r) == 0 and not empty:
+            # same as parse() of empty input
+            self.error(None)
+            return None
+
+        return r
+
+    # Returns list of items or None if text can't be parsed at all.
+    # Results are cached by file path and content.
+    def textParse(self, lexer, text, file, lineno=1, index=0):
+        key = None
+        if file != "/" and lineno == 1 and index == 0:
+            key = hashlib.sha256(
+                "{format}\0{stamp}\0{file}\0".format(
+                    format=AST_FORMAT, stamp=self.stamp, file=file
+                ).encode()
+                + text.encode()
+            ).hexdigest()
+            ast = self.parsed.get(key)
+            if ast is None:
+                ast = self.cache.load(key)
+            if ast is not None:
+                self.parsed.put(key, ast)
+                return ast
+
+        num_errors = lexer.num_errors + self.num_errors
+
+        ast = self.plain.scan(text, file)
+        if ast is None:
+            toks = lexer.tokenize(text, lineno=lineno, index=index, file=file)
+            tok = next(toks, None)
+            if tok is None:
+                return list()
+            ast = self.parse(itertools.chain((tok,), toks))
+
+        # texts with errors are parsed every time to report errors again
+        if key and ast is not None and num_errors == lexer.num_errors + self.num_errors:
+            self.cache.store(key, ast)
+            self.parsed.put(key, ast)
+
+        return ast
+
+    # Returns items list of file with include nodes resolved, None on
+    # errors. Parsed items are shared by parsed memo and AST cache, resolved
+    # include nodes (and nodes they are in) are new ones.
+    def includesResolve(self, lexer, items, file):
+        r = list()
+        for item in items:
+            cls = item.__class__
+            if cls is nodes.Include:
+                # relative include from prepend/append data, reported by lexer
+                if not os.path.isabs(item.path):
+                    r.append(nodes.Include(item.path))
+                    continue
+                if not lexer.includeCheck(item.path, file):
+                    r.append(nodes.Include(item.path))
+                    continue
+
+                # file is pending while its includes are processed
+                lexer.includes.append(tuple(("", 1, 0, file)))
+                ast = self.textParse(lexer, lexer.fileRead(item.path), item.path)
+                if ast is not None:
+                    ast = self.includesResolve(lexer, ast, item.path)
+                lexer.includes.pop()
+                if ast is None:
+                    return None
+
+                item = nodes.Include(item.path, ast)
+            elif cls is nodes.If:
+                true = self.includesResolve(lexer, item.true, file)
+                if true is None:
+                    return None
+                false = self.includesResolve(lexer, item.false, file)
+                if false is None:
+                    return None
+                if self.changed(true, item.true) or self.changed(false, item.false):
+                    item = nodes.If(item.kind, item.left, item.right, tuple(true), tuple(false))
+            elif cls is nodes.Define:
+                body = self.includesResolve(lexer, item.body, file)
+                if body is None:
+                    return None
+                if self.changed(body, item.body):
+                    item = nodes.Define(item.name, tuple(body))
+            r.append(item)
+
+        return r
+
+    @staticmethod
+    def changed(resolved, items):
+        return any(a is not b for a, b in zip(resolved, items))
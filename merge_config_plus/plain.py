@@ -0,0 +1,70 @@
+from .lexer import MCPLexer
+from . import nodes
+
+import re
+
+
+class MCPPlain:
+    """Line oriented scanner for plain Kconfig fragments.
+
+    Handles texts without any %( construct, that consist only of
+    'VAR=value', '# VAR is not set', comments and empty lines.
+    Produces the same AST nodes as MCPLexer + MCPParser would.
+    If text is not plain (or some line is not recognized) scan()
+    returns None and text should be processed with MCPLexer + MCPParser.
+    """
+
+    # Same token patterns (and priorities) as in MCPLexer
+    _re_line = re.compile(
+        r"[ \t]*(?:"
+        r"(?P<unset>" + MCPLexer._re_unset + r")"
+        r"|(?P<var>[A-Z][a-zA-Z0-9_]*)[ \t]*(?P<op>\?=|\+=|=\+|-=|=)[ \t]*"
+        r"(?:(?P<state>[ymn])"
+        r"|(?P<hex>0[xX][a-fA-F0-9][a-fA-F0-9]*)"
+        r"|(?P<int>-?[0-9]+)"
+        r"|(?P<string>\"[^\"\n]*\"|\'[^\'\n]*\'))"
+        r")?[ \t]*(?P<comment>\#.*)?"
+    )
+    _re_unset = re.compile(MCPLexer._re_unset)
+
+    def scan(self, text, file):
+        if "%(" in text or "\r" in text:
+            return None
+
+        r = list()
+        lineno = 0
+
+        for line in text.split("\n"):
+            lineno += 1
+
+            m = self._re_line.fullmatch(line)
+            if m is None:
+                return None
+
+            unset, unset_name, var, op, state, hexval, intval, string, comment = m.groups()
+
+            if unset is not None:
+                r.append(nodes.Config(unset_name, "=", nodes.STATES["n"], lineno, file))
+            elif var is not None:
+                if state is not None:
+                    value = nodes.STATES[state]
+                elif hexval is not None:
+                    value = nodes.Hex(int(hexval, 16))
+                elif intval is not None:
+                    value = nodes.Int(int(intval, 10))
+                else:
+                    value = nodes.String(tuple((nodes.Str(self.string(string)),)))
+                r.append(nodes.Config(var, op, value, lineno, file))
+
+            if comment is not None:
+                # lexer would take it as '# VAR is not set' with some garbage
+                # or as another config after statement
+                if self._re_unset.match(comment):
+                    return None
+                r.append(nodes.Comment(comment[1:]))
+
+        return r
+
+    def string(self, value):
+        # same as MCPLexer.STRING()
+        return value[1:-1].replace("\\n", "\n").replace("\\t", "\t")
@@ -0,0 +1,155 @@
+from .functions import MCPMemo
+
+import re
+
+
+class MCPRemover:
+    """Removes several substrings from text at once.
+
+    Result is always the same as of text.replace(pattern, "") applied for
+    every pattern in order. With many patterns all their occurrences are
+    found in one pass of a regex built as a trie of patterns. Removals are
+    done one by one if patterns can overlap each other or if some removal
+    makes a new occurrence (text around it joins into a pattern), as order
+    matters then.
+    """
+
+    # Below this number of patterns separate str.replace() scans are faster
+    # than one regex pass (measured on 0.5K..50K strings)
+    batch_min = 80
+
+    # patterns tuple -> MCPRemover
+    compiled = MCPMemo(size=64)
+
+    @classmethod
+    def get(cls, patterns):
+        patterns = tuple(patterns)
+        r = cls.compiled.get(patterns)
+        if r is None:
+            r = cls(patterns)
+            cls.compiled.put(patterns, r)
+        return r
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+
+        # empty pattern removes nothing, repeated one removes only what
+        # earlier removals made, such texts are done one by one anyway
+        self.unique = list()
+        self.label = dict()
+        for pattern in self.patterns:
+            if pattern != "" and pattern not in self.label:
+                self.label[pattern] = len(self.unique)
+                self.unique.append(pattern)
+
+        self.regex = None
+        self.lookahead = None
+        if len(self.unique) >= self.batch_min and self.disjoint(self.unique):
+            trie = self.trie(self.unique)
+            self.regex = re.compile(trie)
+            # every occurrence, overlapping ones too
+            self.lookahead = re.compile("(?=(" + trie + "))")
+            self.longest = max(len(pattern) for pattern in self.unique)
+
+    @staticmethod
+    def disjoint(patterns):
+        """True if occurrences of patterns can't overlap in any text."""
+        for p in patterns:
+            for q in patterns:
+                if p != q and p in q:
+                    return False
+                # some suffix of p is a prefix of q
+                for i in range(1, len(p)):
+                    if q.startswith(p[i:]):
+                        return False
+        return True
+
+    @staticmethod
+    def trie(patterns):
+        root = dict()
+        for pattern in patterns:
+            node = root
+            for char in pattern:
+                node = node.setdefault(char, dict())
+            node[""] = None
+
+        def build(node):
+            alternatives = list()
+            end = False
+            for char, sub in sorted(node.items()):
+                if char == "":
+                    end = True
+                else:
+                    alternatives.append(re.escape(char) + build(sub))
+
+            if len(alternatives) == 0:
+                return ""
+            if len(alternatives) == 1:
+                r = alternatives[0]
+            else:
+                r = "(?:" + "|".join(alternatives) + ")"
+            if end:
+                r = "(?:" + r + ")?"
+            return r
+
+        return build(root)
+
+    def apply(self, text):
+        if self.regex is None:
+            return self.sequential(text)
+
+        matches = [tuple((m.start(), m.end())) for m in self.regex.finditer(text)]
+        if len(matches) == 0:
+            return text
+        if self.creates(text, matches):
+            return self.sequential(text)
+
+        parts = list()
+        last = 0
+        for start, end in matches:
+            parts.append(text[last:start])
+            last = end
+        parts.append(text[last:])
+        return "".join(parts)
+
+    def sequential(self, text):
+        for pattern in self.patterns:
+            text = text.replace(pattern, "")
+        return text
+
+    # True if one by one removal would make new occurrence somewhere.
+    # Only text near removed occurrences can change, matches closer than
+    # the longest pattern are checked together, once for every state of
+    # them during one by one removal.
+    def creates(self, text, matches):
+        reach = self.longest - 1
+        cluster = [matches[0]]
+
+        for match in matches[1:] + [None]:
+            if match is not None and match[0] - cluster[-1][1] < self.longest:
+                cluster.append(match)
+                continue
+
+            begin = max(0, cluster[0][0] - reach)
+            finish = min(len(text), cluster[-1][1] + reach)
+            labels = [self.label[text[start:end]] for start, end in cluster]
+
+            for step in sorted(set(labels)):
+                window = ""
+                junctions = set()
+                last = begin
+                for (start, end), label in zip(cluster, labels):
+                    if label <= step:
+                        window += text[last:start]
+                        junctions.add(len(window))
+                        last = end
+                window += text[last:finish]
+
+                for m in self.lookahead.finditer(window):
+                    for junction in junctions:
+                        if m.start(1) < junction < m.end(1):
+                            return True
+
+            cluster = [match]
+
+        return False
@@ -0,0 +1,356 @@
+from .lexer import MCPLexer
+from .parser import MCPParser
+from .ast import MCPAst, MCPRecords
+from .format import MCPFormat
+from .files import files
+from .cache import MCPRunCache, MCPManifest
+
+import io
+import os
+import sys
+import logging
+
+
+def hierarchy_print(items, base_dir, output, level=0):
+    # first level is stored in revetsed order
+    if level == 0:
+        entries = items[::-1]
+    else:
+        entries = items
+
+    for item in entries:
+        f = os.path.relpath(item[0], start=base_dir)
+        if item[2] != "":
+            print(
+                "#" + "".join(level * "  "), "*", f, "(", item[2], ")", file=output
+            )
+        else:
+            print("#" + "".join(level * "  "), "*", f, file=output)
+        hierarchy_print(item[1], base_dir, output, level + 1)
+
+
+def hierarchy_flat(items, base_dir):
+    r = list()
+    for item in items:
+        f = os.path.relpath(item[0], start=base_dir)
+        r.append(f)
+        r.extend(hierarchy_flat(item[1], base_dir))
+    return r
+
+
+# Absolute paths of all files in hierarchy items
+def hierarchy_files(items):
+    r = list()
+    for item in items:
+        r.append(item[0])
+        r.extend(hierarchy_files(item[1]))
+    return r
+
+
+class MCPRun:
+    """Normal mode processing of parsed command line args.
+
+    read() adds input files to lexer, run() processes them to output and
+    returns exit code. argv is the command line run cache key is built
+    from. Runs of one process can share parser (and its parsed texts),
+    stdout None is sys.stdout at the time of run().
+    """
+
+    def __init__(self, args, argv, parser=None, stdout=None):
+        self.logger = logging.getLogger("mcp")
+        self.args = args
+        self.argv = argv
+        self.lexer = MCPLexer()
+        self.parser = parser or MCPParser()
+        self.stdout = stdout
+        # texts of input files, in reversed order
+        self.texts = list()
+        self.num_errors = 0
+
+    # Returns False if there are no input files (interactive mode)
+    def read(self):
+        if not self.args.files or len(self.args.files) == 0:
+            return False
+
+        # files should be added in reversed order
+        for file in self.args.files[::-1]:
+            text = file.read()
+            if file is not sys.stdin:
+                file.close()
+            self.texts.append(text)
+            self.lexer.textAdd(text, os.path.abspath(file.name), "from cmd line")
+            self.logger.debug("File '%s' added", file.name)
+        return True
+
+    def dirs(self):
+        if self.args.base_dir:
+            base_dir = os.path.abspath(self.args.base_dir)
+        else:
+            # if not set, than same as first input file dir
+            base_dir = os.path.dirname(os.path.abspath(self.args.files[0].name))
+
+        if self.args.tmp_dir:
+            tmp_dir = os.path.abspath(self.args.tmp_dir)
+        else:
+            tmp_dir = base_dir
+
+        return base_dir, tmp_dir
+
+    def run(self):
+        args = self.args
+        self.base_dir, self.tmp_dir = self.dirs()
+
+        MCPAst.shellcache.enabled = not args.no_shell_cache
+
+        if args.output == "-":
+            self.output_file = os.path.abspath("<stdout>")
+        else:
+            self.output_file = os.path.abspath(args.output)
+
+        # same command line, input files and everything they depended on give
+        # the same result, run isn't repeated then
+        runcache = MCPRunCache()
+        if args.no_run_cache:
+            runcache.enabled = False
+        run_key = runcache.key(self.argv, self.texts)
+        cached = runcache.load(run_key, MCPAst.shellcache)
+
+        if cached is not None:
+            self.logger.debug("Run result taken from cache")
+            for record in cached["records"]:
+                logging.getLogger(record.name).handle(record)
+
+            output_path = self.outputResolve(cached["output_name"])
+            output_text = cached["output"]
+
+            outputs = dict()
+            for path, text in cached["saved"].items():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                outputs[path] = files.write(path, text)
+        else:
+            # log of the run is given back on cache hit
+            records = MCPRecords()
+            self.logger.addHandler(records)
+            try:
+                r = self.process(records)
+            finally:
+                self.logger.removeHandler(records)
+
+            if r is None:
+                return 1
+
+            output_name, output_path, output_text, outputs, manifest = r
+            runcache.store(
+                run_key,
+                manifest,
+                dict(records=records.records, output_name=output_name, output=output_text),
+            )
+
+        if output_path is None:
+            (self.stdout or sys.stdout).write(output_text)
+        else:
+            path = os.path.abspath(output_path)
+            written = files.write(output_path, output_text)
+            outputs[path] = outputs.get(path, False) or written
+        self.outputsReport(outputs)
+
+        self.logger.info("Processing to '{out}' done".format(out=output_path or "<stdout>"))
+        return 0
+
+    # Processes input, returns output name set by config, output path,
+    # text, outputs and manifest of the run, None if there were errors
+    def process(self, records):
+        args = self.args
+        lexer = self.lexer
+        parser = self.parser
+        base_dir = self.base_dir
+        texts = self.texts
+        # parser may be shared with previous runs, %(process) sub runs
+        # use it too (and report their errors themselves)
+        parser_errors = parser.num_errors
+
+        # var history is collected only if it will be printed
+        ast = MCPAst(history=args.history, jobs=max(1, args.jobs), parser=parser)
+        shellcache = MCPAst.shellcache
+        shell_hits, shell_misses = shellcache.hits, shellcache.misses
+
+        # append data and input files are evaluated first (prepend data goes
+        # last), state after the first --checkpoint files is kept for runs
+        # with the same ones. Output path isn't a part of the key, prefix
+        # that refers LOCAL_OUTPUT_ vars isn't kept. Least recently used
+        # checkpoints are removed above 128M.
+        checkpoints = MCPRunCache(name="checkpoint", budget=128 << 20)
+        prefix = min(max(0, args.checkpoint), len(args.files))
+        checkpoint_key = None
+        checkpoint = None
+        if prefix > 0:
+            names = [os.path.abspath(file.name) for file in args.files[:prefix]]
+            checkpoint_key = checkpoints.key(
+                [base_dir, self.tmp_dir, args.history, shellcache.enabled, args.append]
+                + names,
+                texts[::-1][:prefix],
+            )
+            checkpoint = checkpoints.load(checkpoint_key, shellcache)
+
+        if checkpoint is not None:
+            self.logger.debug("State after first %d files taken from checkpoint", prefix)
+
+            # only the rest of files is parsed
+            lexer = self.lexer = MCPLexer()
+            for file, text in zip(args.files[prefix:][::-1], texts):
+                lexer.textAdd(text, os.path.abspath(file.name), "from cmd line")
+            lexer.hierarchy.extend(checkpoint["hierarchy"])
+            # the rest can be empty (or every input file is in checkpoint)
+            items = parser.parse2(lexer, prepend=args.prepend, empty=True)
+            parse_errors = parser.num_errors - parser_errors
+
+            for record in checkpoint["records"]:
+                logging.getLogger(record.name).handle(record)
+            ast.restore(checkpoint["ast"])
+            for name, value in (
+                ("LOCAL_OUTPUT_DIR", os.path.dirname(self.output_file)),
+                ("LOCAL_OUTPUT_NAME", os.path.basename(self.output_file)),
+            ):
+                ast.configs.get(name)[2][-1] = tuple(("string", value, 0, "/"))
+            shellcache.hits += checkpoint["hits"]
+            shellcache.misses += checkpoint["misses"]
+
+            manifest = checkpoints.manifest(checkpoint)
+            for path, text in manifest.saved.items():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                ast.outputAdd(path, files.write(path, text))
+            ast.shared.manifest.update(manifest)
+
+            ast.process(items)
+        else:
+            ast.configAdd("LOCAL_BASE", "string", base_dir, 0, "/")
+            ast.configAdd("LOCAL_TMP", "string", self.tmp_dir, 0, "/")
+
+            # Deprecated
+            ## Path for generated content (if anything), always setuped as first input file directory name
+            ##ast.configAdd("LOCAL_GENERATED", "string", os.path.dirname(os.path.abspath(args.files[0].name)), 0, "/")
+
+            ast.configAdd("LOCAL_OUTPUT_DIR", "string", os.path.dirname(self.output_file), 0, "/")
+            ast.configAdd("LOCAL_OUTPUT_NAME", "string", os.path.basename(self.output_file), 0, "/")
+            #ast.configAdd("LOCAL_OUTPUT_REAL_NAME", "string", os.path.basename(self.output_file), 0, "/")
+
+            bounds = list()
+            items = parser.parse2(
+                lexer, prepend=args.prepend, append=args.append, bounds=bounds
+            )
+            parse_errors = parser.num_errors - parser_errors
+
+            if checkpoint_key is not None and items is not None:
+                split = bounds[prefix - 1 + (1 if args.append else 0)]
+                start = len(records.records)
+                hits, misses = shellcache.hits, shellcache.misses
+
+                ast.process(items[:split])
+
+                hierarchy = lexer.hierarchy[len(lexer.hierarchy) - prefix :]
+                manifest = MCPManifest()
+                manifest.update(ast.shared.manifest)
+                for item in hierarchy:
+                    for path in hierarchy_files(item[1]):
+                        manifest.files[path] = lexer.reads[path]
+
+                sources = [args.append] + texts[::-1][:prefix] + list(manifest.files.values())
+                num_errors = lexer.num_errors + parse_errors
+                if any("LOCAL_OUTPUT_" in text for text in sources):
+                    self.logger.debug("Prefix refers output vars, checkpoint isn't stored")
+                elif num_errors + ast.num_errors == 0:
+                    checkpoints.store(
+                        checkpoint_key,
+                        manifest,
+                        dict(
+                            ast=ast.checkpoint(),
+                            hierarchy=hierarchy,
+                            records=records.records[start:],
+                            hits=shellcache.hits - hits,
+                            misses=shellcache.misses - misses,
+                        ),
+                    )
+
+                items = items[split:]
+
+            ast.process(items)
+
+        hits = shellcache.hits - shell_hits
+        misses = shellcache.misses - shell_misses
+        if hits + misses > 0:
+            self.logger.info(
+                "Shell cache: {hits} hits, {misses} misses".format(hits=hits, misses=misses)
+            )
+
+        output_name = ast.realOutput()
+        output_path = self.outputResolve(output_name)
+        outputs = ast.shared.outputs
+
+        self.num_errors = 0
+        self.num_errors += lexer.num_errors
+        self.num_errors += parse_errors
+        self.num_errors += ast.num_errors
+
+        if self.num_errors > 0:
+            self.logger.warning(
+                "Processing to '{out}' done, but there were {num} warnings/errors".format(
+                    out=output_path or "<stdout>", num=self.num_errors
+                )
+            )
+            # previous output isn't left as result of failed run
+            if output_path is not None and os.path.exists(output_path):
+                os.remove(output_path)
+            self.outputsReport(outputs)
+            return None
+
+        # Output, rendered to memory to be compared with existing file
+        output = io.StringIO()
+        print("# This file was generated by merge_config_plus", file=output)
+
+        if not args.strip_include:
+            print("# Files include structure:", file=output)
+            if args.prepend:
+                print("# *", "prepend data", file=output)
+            hierarchy_print(lexer.hierarchy, base_dir, output)
+            if args.append:
+                print("# *", "append data", file=output)
+            print("", file=output)
+
+        strip_prev = not args.history
+
+        format = MCPFormat(output, base_dir, strip_prev=strip_prev)
+        format.output(ast.configs)
+
+        manifest = ast.shared.manifest
+        manifest.files.update(lexer.reads)
+        return tuple((output_name, output_path, output.getvalue(), outputs, manifest))
+
+    # Returns path of main output (None is stdout), -o file is removed if
+    # config sets another name
+    def outputResolve(self, output_name):
+        if output_name == "":
+            return None if self.args.output == "-" else self.args.output
+
+        #TODO
+        if self.args.output != "-" and os.path.exists(self.args.output):
+            os.remove(self.args.output)
+        return os.path.dirname(self.output_file) + "/" + output_name
+
+    def outputsReport(self, outputs):
+        written = list()
+        unchanged = 0
+        for path, changed in outputs.items():
+            if changed:
+                written.append(os.path.relpath(path, start=self.base_dir))
+            else:
+                self.logger.debug("Output '%s' unchanged", path)
+                unchanged += 1
+
+        if len(outputs) > 0:
+            self.logger.info(
+                "Outputs: {num} written{names}, {unchanged} unchanged".format(
+                    num=len(written),
+                    names=" (" + ", ".join(written) + ")" if written else "",
+                    unchanged=unchanged,
+                )
+            )
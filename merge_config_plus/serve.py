@@ -0,0 +1,283 @@
+from .parser import MCPParser
+from .files import files
+from .cache import package_stamp
+
+import io
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import struct
+import locale
+import logging
+import traceback
+
+
+# Frame is 1 byte type, 4 bytes payload length and payload:
+#   q - request (client): JSON with argv, cwd, env, umask, stdin and stdout
+#       [encoding, errors] and locale (preferred encoding)
+#   i - stdin data (client), empty is end of file
+#   r - stdin read (server), payload is max number of bytes
+#   o, e - stdout, stderr data (server)
+#   x - exit code (server), last frame of request
+#   f - fallback (server), client has to run one-shot CLI itself
+HEADER = struct.Struct("!cI")
+
+
+def frameSend(sock, kind, data=b""):
+    sock.sendall(HEADER.pack(kind, len(data)) + data)
+
+
+# Returns (type, payload), None if connection was closed
+def frameRecv(sock):
+    header = recvExact(sock, HEADER.size)
+    if header is None:
+        return None
+    kind, size = HEADER.unpack(header)
+    data = recvExact(sock, size)
+    if data is None:
+        return None
+    return tuple((kind, data))
+
+
+def recvExact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+
+# OSError, so log handlers ignore it as any broken stream
+class MCPClientDisconnected(ConnectionError):
+    pass
+
+
+class MCPClientWriter(io.RawIOBase):
+    """stdout or stderr of client, every write is one frame."""
+
+    def __init__(self, sock, kind, name):
+        super().__init__()
+        self.sock = sock
+        self.kind = kind
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        try:
+            frameSend(self.sock, self.kind, bytes(data))
+        except OSError as e:
+            raise MCPClientDisconnected(e)
+        return len(data)
+
+
+class MCPClientReader(io.RawIOBase):
+    """stdin of client, data is asked for only when it's read."""
+
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+        self.name = "<stdin>"
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.eof:
+            return 0
+        try:
+            frameSend(self.sock, b"r", str(len(buffer)).encode())
+            frame = frameRecv(self.sock)
+        except OSError as e:
+            raise MCPClientDisconnected(e)
+        if frame is None or frame[0] != b"i":
+            raise MCPClientDisconnected("no stdin data")
+
+        data = frame[1][: len(buffer)]
+        if not data:
+            self.eof = True
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class MCPServer:
+    """Daemon for --serve, runs command lines sent by
+    merge_config_plus_client.py.
+
+    Requests are taken one by one from Unix socket. Every request runs
+    main() in daemon process with client's cwd, environment, umask and
+    stdio, so exit code, output and written files are the same as of
+    one-shot CLI. Parser (grammar tables and parsed fragments) and files
+    cache stay in memory between requests, they are validated by content
+    or file stats as always, files cache is swept after every request.
+    Client with other preferred encoding is told to fall back to one-shot
+    CLI, if package code was changed daemon exits after that.
+    """
+
+    def __init__(self, path, main):
+        self.path = path
+        self.main = main
+        self.parser = MCPParser()
+        self.stamp = package_stamp()
+        self.requests = 0
+
+        # daemon log doesn't go to clients
+        self.logger = logging.getLogger("mcp-serve")
+        if not self.logger.handlers:
+            self.logger.addHandler(logging.StreamHandler(sys.__stderr__))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.getLogger("mcp").getEffectiveLevel())
+
+    # Returns listening socket, None if another daemon uses path
+    def listen(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            try:
+                sock.bind(self.path)
+            except OSError as e:
+                if e.errno != errno.EADDRINUSE:
+                    raise
+                # path is left by daemon that wasn't stopped cleanly
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(self.path)
+                    sock.close()
+                    return None
+                except OSError:
+                    os.unlink(self.path)
+                finally:
+                    probe.close()
+                sock.bind(self.path)
+        except BaseException:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+
+        sock.listen(16)
+        return sock
+
+    def run(self):
+        try:
+            sock = self.listen()
+        except OSError as e:
+            self.logger.error("Can't listen on '{path}': {msg}".format(path=self.path, msg=e))
+            return 1
+        if sock is None:
+            self.logger.error("'{path}' is used by another server".format(path=self.path))
+            return 1
+
+        # stopped by SIGTERM the same way as by CTRL+C
+        def stop(signum, frame):
+            raise KeyboardInterrupt()
+
+        previous = signal.signal(signal.SIGTERM, stop)
+        self.logger.info("Serving on '{path}'".format(path=self.path))
+        try:
+            while True:
+                conn, _ = sock.accept()
+                with conn:
+                    if not self.handle(conn):
+                        break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            sock.close()
+            os.unlink(self.path)
+
+        self.logger.info("Server stopped after {num} requests".format(num=self.requests))
+        return 0
+
+    # Returns False if server has to exit
+    def handle(self, conn):
+        try:
+            frame = frameRecv(conn)
+            if frame is None or frame[0] != b"q":
+                return True
+            request = json.loads(frame[1].decode())
+
+            if package_stamp() != self.stamp:
+                self.logger.info("Package code changed, exiting")
+                frameSend(conn, b"f")
+                return False
+            if request["locale"] != locale.getpreferredencoding(False):
+                self.logger.debug("Client locale differs, fallback")
+                frameSend(conn, b"f")
+                return True
+
+            code = self.request(conn, request)
+            frameSend(conn, b"x", str(code).encode())
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning("Request failed: {msg}".format(msg=e))
+        finally:
+            dropped = files.sweep()
+            self.logger.debug("%d changed files dropped from cache", dropped)
+
+        return True
+
+    # Runs request in client's context, returns exit code
+    def request(self, conn, request):
+        self.requests += 1
+        self.logger.debug("Request %d: %s", self.requests, request["argv"])
+
+        stdout = io.TextIOWrapper(
+            io.BufferedWriter(MCPClientWriter(conn, b"o", "<stdout>")),
+            encoding=request["stdout"][0],
+            errors=request["stdout"][1],
+        )
+        stderr = io.TextIOWrapper(
+            MCPClientWriter(conn, b"e", "<stderr>"),
+            encoding=request["stdout"][0],
+            errors="backslashreplace",
+            write_through=True,
+        )
+        stdin = io.TextIOWrapper(
+            io.BufferedReader(MCPClientReader(conn)),
+            encoding=request["stdin"][0],
+            errors=request["stdin"][1],
+        )
+
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        umask = os.umask(request["umask"])
+        streams = tuple((sys.stdin, sys.stdout, sys.stderr))
+        try:
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request["env"])
+            sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+
+            try:
+                code = self.main(request["argv"], parser=self.parser)
+            except SystemExit as e:
+                # argparse errors, exit() in main
+                if e.code is None:
+                    code = 0
+                elif isinstance(e.code, int):
+                    code = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    code = 1
+            except MCPClientDisconnected:
+                raise
+            except Exception:
+                traceback.print_exc()
+                code = 1
+
+            stdout.flush()
+            return code
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = streams
+            os.environ.clear()
+            os.environ.update(environ)
+            os.umask(umask)
+            os.chdir(cwd)
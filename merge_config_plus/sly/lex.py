@@ -35,6 +35,7 @@ __all__ = ['Lexer', 'LexerStateChange']
 
 import re
 import copy
+import hashlib
 
 class LexError(Exception):
     '''
@@ -188,6 +189,10 @@ class Lexer(metaclass=LexerMeta):
     reflags = 0
     regex_module = re
 
+    # Optional cache of validated rules. Object with load(key) and
+    # store(key, data) methods, key is hash of token rules
+    patterncache = None
+
     _token_names = set()
     _token_funcs = {}
     _ignored_tokens = set()
@@ -305,21 +310,31 @@ class Lexer(metaclass=LexerMeta):
 
             # Form the regular expression component
             part = f'(?P<{tokname}>{pattern})'
+            parts.append((tokname, part))
+
+        if not parts:
+            return
 
-            # Make sure the individual regex compiles properly
-            try:
-                cpat = cls.regex_module.compile(part, cls.reflags)
-            except Exception as e:
-                raise PatternError(f'Invalid regex for token {tokname}') from e
+        # Rules that were already validated are not compiled one by one again
+        key = None
+        validated = False
+        if cls.patterncache is not None:
+            key = hashlib.sha256(repr((parts, cls.reflags)).encode()).hexdigest()
+            validated = cls.patterncache.load(key) is not None
 
-            # Verify that the pattern doesn't match the empty string
-            if cpat.match(''):
-                raise PatternError(f'Regex for token {tokname} matches empty input')
+        if not validated:
+            for tokname, part in parts:
+                # Make sure the individual regex compiles properly
+                try:
+                    cpat = cls.regex_module.compile(part, cls.reflags)
+                except Exception as e:
+                    raise PatternError(f'Invalid regex for token {tokname}') from e
 
-            parts.append(part)
+                # Verify that the pattern doesn't match the empty string
+                if cpat.match(''):
+                    raise PatternError(f'Regex for token {tokname} matches empty input')
 
-        if not parts:
-            return
+        parts = [ part for tokname, part in parts ]
 
         # Form the master regular expression
         #previous = ('|' + cls._master_re.pattern) if cls._master_re else ''
@@ -333,6 +348,9 @@ class Lexer(metaclass=LexerMeta):
         if not all(isinstance(lit, str) for lit in cls.literals):
             raise LexerBuildError('literals must be specified as strings')
 
+        if cls.patterncache is not None and not validated:
+            cls.patterncache.store(key, True)
+
     def begin(self, cls):
         '''
         Begin a new lexer state
@@ -33,6 +33,7 @@
 
 import sys
 import inspect
+import hashlib
 from collections import OrderedDict, defaultdict, Counter
 
 __all__        = [ 'Parser' ]
@@ -528,6 +529,21 @@ class Grammar(object):
         self.Nonterminals[start].append(0)
         self.Start = start
 
+    # -----------------------------------------------------------------------------
+    # signature()
+    #
+    # Hash of terminals, precedence and productions. Grammars with the same
+    # signature produce the same LR tables.
+    # -----------------------------------------------------------------------------
+
+    def signature(self):
+        h = hashlib.sha256()
+        h.update(repr(sorted(self.Terminals)).encode())
+        h.update(repr(sorted(self.Precedence.items())).encode())
+        for p in self.Productions:
+            h.update(repr((p.name, p.prod, p.prec)).encode())
+        return h.hexdigest()
+
     # -----------------------------------------------------------------------------
     # find_unreachable()
     #
@@ -942,6 +958,25 @@ class LALRError(YaccError):
 # public methods except for write()
 # -----------------------------------------------------------------------------
 
+# -----------------------------------------------------------------------------
+# class LRTableData:
+#
+# Serializable part of LRTable, everything Parser.parse() needs.
+# Used to store tables in Parser.tablecache.
+# -----------------------------------------------------------------------------
+
+class LRTableData(object):
+    def __init__(self, lrtable):
+        self.lr_action        = lrtable.lr_action
+        self.lr_goto          = lrtable.lr_goto
+        self.defaulted_states = lrtable.defaulted_states
+        self.sr_conflicts     = lrtable.sr_conflicts
+        self.rr_conflicts     = [ (state, str(chosenp), str(rejectp))
+                                  for state, chosenp, rejectp in lrtable.rr_conflicts ]
+
+    def __str__(self):
+        return 'LR tables loaded from cache\n'
+
 class LRTable(object):
     def __init__(self, grammar):
         self.grammar = grammar
@@ -1838,6 +1873,10 @@ class Parser(metaclass=ParserMeta):
     # Debugging filename where parsetab.out data can be written
     debugfile = None
 
+    # Optional LR tables cache. Object with load(key) and store(key, data)
+    # methods, key is grammar signature, data is LRTableData
+    tablecache = None
+
     @classmethod
     def __validate_tokens(cls):
         if not hasattr(cls, 'tokens'):
@@ -1975,7 +2014,16 @@ class Parser(metaclass=ParserMeta):
         '''
         Build the LR Parsing tables from the grammar
         '''
-        lrtable = LRTable(cls._grammar)
+        lrtable = None
+        if cls.tablecache is not None:
+            key = cls._grammar.signature()
+            lrtable = cls.tablecache.load(key)
+
+        if lrtable is None:
+            lrtable = LRTable(cls._grammar)
+            if cls.tablecache is not None:
+                cls.tablecache.store(key, LRTableData(lrtable))
+
         num_sr = len(lrtable.sr_conflicts)
 
         # Report shift/reduce and reduce/reduce conflicts
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Thin client of merge_config_plus --serve daemon.
+
+Sends command line, cwd, environment and umask to daemon listening on
+MCP_SOCKET, passes its stdout and stderr through (stdin is read when
+daemon asks for it) and exits with its exit code. Only standard library
+is imported, not the package. Without MCP_SOCKET, if daemon isn't running
+or asks for it, one-shot CLI is run instead.
+
+    MCP_SOCKET=/tmp/mcp.sock ./merge_config_plus_client.py -o .config -f a.config
+"""
+
+import os
+import sys
+import json
+import socket
+import struct
+import locale
+
+# framing of merge_config_plus/serve.py
+HEADER = struct.Struct("!cI")
+
+
+def frameSend(sock, kind, data=b""):
+    sock.sendall(HEADER.pack(kind, len(data)) + data)
+
+
+def frameRecv(sock):
+    header = recvExact(sock, HEADER.size)
+    if header is None:
+        return None
+    kind, size = HEADER.unpack(header)
+    data = recvExact(sock, size)
+    if data is None:
+        return None
+    return tuple((kind, data))
+
+
+def recvExact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+
+# Replaces client with one-shot CLI
+def fallback(argv):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    paths = [path for path in env.get("PYTHONPATH", "").split(os.pathsep) if path]
+    if not paths or paths[0] != base_dir:
+        env["PYTHONPATH"] = os.pathsep.join([base_dir] + paths)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execve(sys.executable, [sys.executable, "-m", "merge_config_plus"] + argv, env)
+
+
+# [encoding, errors] daemon uses for stream
+def streamArgs(stream):
+    if stream is None:
+        return [locale.getpreferredencoding(False), "strict"]
+    return [stream.encoding, stream.errors]
+
+
+def main(argv):
+    path = os.environ.get("MCP_SOCKET")
+    if not path:
+        fallback(argv)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        fallback(argv)
+
+    umask = os.umask(0)
+    os.umask(umask)
+
+    request = dict(
+        argv=argv,
+        cwd=os.getcwd(),
+        env=dict(os.environ),
+        umask=umask,
+        stdin=streamArgs(sys.stdin),
+        stdout=streamArgs(sys.stdout),
+        locale=locale.getpreferredencoding(False),
+    )
+
+    with sock:
+        received = False
+        try:
+            frameSend(sock, b"q", json.dumps(request).encode())
+        except OSError:
+            fallback(argv)
+
+        while True:
+            try:
+                frame = frameRecv(sock)
+            except OSError:
+                frame = None
+
+            if frame is None:
+                # daemon exited before taking request
+                if not received:
+                    fallback(argv)
+                print("merge_config_plus: server closed connection", file=sys.stderr)
+                return 1
+
+            kind, data = frame
+            if kind == b"f":
+                fallback(argv)
+            received = True
+
+            if kind == b"o":
+                sys.stdout.flush()
+                sys.stdout.buffer.write(data)
+                sys.stdout.buffer.flush()
+            elif kind == b"e":
+                sys.stderr.flush()
+                sys.stderr.buffer.write(data)
+                sys.stderr.buffer.flush()
+            elif kind == b"r":
+                try:
+                    data = os.read(sys.stdin.fileno(), int(data))
+                except (OSError, AttributeError, ValueError):
+                    data = b""
+                frameSend(sock, b"i", data)
+            elif kind == b"x":
+                return int(data)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,478 @@
+import pytest
+import os
+import asyncio
+
+from merge_config_plus import MCPLexer
+from merge_config_plus import MCPParser
+from merge_config_plus import MCPAst
+
+
+def process(data):
+    lexer = MCPLexer()
+    parser = MCPParser()
+    ast = MCPAst()
+
+    ast.process(parser.parse(lexer.tokenize2(data)))
+
+    return ast
+
+
+test_configs = [
+    (
+        "A=y\nB=1\nA=m",
+        [("comment", " A was 'm'"), ("config", "B"), ("config", "A")],
+    ),
+    (
+        "LOCAL_A=y\nB=1\nLOCAL_A=m",
+        [("config", "B"), ("config", "LOCAL_A")],
+    ),
+    (
+        "A='1'\nA+='2'\nA=+'0'\nA-='1'",
+        [
+            ("comment", " A was '12'"),
+            ("comment", " A was '012'"),
+            ("comment", " A was '02'"),
+            ("config", "A"),
+        ],
+    ),
+]
+
+
+@pytest.mark.parametrize("data,tarr", test_configs)
+def test_configs_order(data, tarr):
+    ast = process(data)
+
+    counter = 0
+    for item in ast.configs:
+        assert item[:2] == tarr[counter]
+        counter += 1
+
+    assert counter == len(tarr)
+
+
+test_values = [
+    ("A=y", "A", ("y", "state", True)),
+    ("A=0x10\nA?=1", "A", ("16", "hex", True)),
+    ("A?=1", "A", ("1", "int", True)),
+    ("A='1'\nA+='2'\nA=+'0'", "A", ("012", "string", True)),
+    ("A='abcabc'\nA-='b'", "A", ("acac", "string", True)),
+    ("A=1\nB=%(A)", "B", ("1", "int", True)),
+    ("A=1", "B", ("", "string", False)),
+]
+
+
+@pytest.mark.parametrize("data,name,value", test_values)
+def test_config_value(data, name, value):
+    ast = process(data)
+
+    assert ast.configValue(name, strict=False) == value
+    assert ast.num_errors == 0
+
+
+def test_configs_compact():
+    ast = MCPAst()
+
+    for i in range(100):
+        ast.configAdd("LOCAL_A", "int", i, i, "/")
+        ast.configAdd("B", "int", i, i, "/")
+
+    ast.configs.compact()
+
+    assert len(ast.configs) == 101
+    assert ast.configValue("LOCAL_A") == ("99", "int", True)
+    assert list(ast.configs)[-1][1] == "B"
+    assert list(ast.configs)[-2][1] == "LOCAL_A"
+    assert list(ast.configs)[-3] == ("comment", " B was '99'")
+
+
+@pytest.mark.parametrize("history,size", [(False, 1), (True, 3)])
+def test_config_history(history, size):
+    ast = MCPAst(history=history)
+
+    for i in range(3):
+        ast.configAdd("A", "int", i, i, "/")
+
+    assert len(ast.configs.get("A")[2]) == size
+    assert ast.configs.get("A")[2][-1] == ("int", 2, 2, "/")
+
+
+test_compiled = [
+    ("%(define 'd')\nA+='x'\n%(endef)\nA=''\n%(call 'd')\n%(call 'd')", "A", "xx", 0),
+    ("A=1\n%(ifeq %(A),'1')\nB='t'\n%(else)\nB='f'\n%(endif)", "B", "t", 0),
+    ("A=1\n%(ifneq %(A),'1')\nB='t'\n%(else)\nB='f'\n%(endif)", "B", "f", 0),
+    ("B=%(unknown %(A))", "B", "", 2),
+    ("%(call 'd')\n%(define 'd')\nB=y\n%(endef)", "B", "", 1),
+]
+
+
+@pytest.mark.parametrize("data,name,value,errors", test_compiled)
+def test_compiled(data, name, value, errors):
+    ast = process(data)
+
+    assert ast.configValue(name, strict=False)[0] == value
+    assert ast.num_errors == errors
+
+
+def test_shell_cache(tmp_path):
+    from merge_config_plus.cache import MCPShellCache
+
+    counter = tmp_path / "counter"
+    counter.write_text("")
+    data = (
+        "LOCAL_SHELL_CACHE=y\n"
+        "LOCAL_SHELL_CACHE_INPUTS='input'\n"
+        "A=%(shell 'sh','-c','echo x >> {counter}; cat {input}')\n"
+    ).format(counter=counter, input=tmp_path / "input")
+    file = str(tmp_path / "main.txt")
+
+    shellcache = MCPShellCache(str(tmp_path / "cache"))
+    values = list()
+
+    for text in ["1", "1", "2"]:
+        (tmp_path / "input").write_text(text)
+
+        lexer = MCPLexer()
+        lexer.textAdd(data, file)
+        ast = MCPAst()
+        ast.shellcache = shellcache
+        ast.process(MCPParser().parse2(lexer))
+
+        assert ast.num_errors == 0
+        values.append(ast.configValue("A")[0])
+
+    assert values == ["b'1'", "b'1'", "b'2'"]
+    assert counter.read_text() == "x\nx\n"
+    assert (shellcache.hits, shellcache.misses) == (1, 2)
+
+
+def test_shell_cache_budget(tmp_path):
+    from merge_config_plus.cache import MCPShellCache
+
+    shellcache = MCPShellCache(str(tmp_path / "cache"), budget=1)
+    for n in range(3):
+        (tmp_path / "input").write_text(str(n))
+        key = shellcache.key(["cat", "input"], [], [str(tmp_path / "input")])
+        shellcache.store(key, str(n))
+
+    # results for old input contents don't pile up
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+    assert shellcache.load(key) == "2"
+
+
+def test_shell_cache_jobs(tmp_path):
+    from merge_config_plus.cache import MCPShellCache
+
+    counter = tmp_path / "counter"
+    counter.write_text("")
+    data = (
+        "LOCAL_SHELL_CACHE=y\n"
+        "C=3\n"
+        "A=%(shell 'sh','-c','echo x >> {counter}; echo 1')\n"
+        "B=%(shell 'sh','-c','echo x >> {counter}; echo 1')\n"
+    ).format(counter=counter)
+
+    lexer = MCPLexer()
+    lexer.textAdd(data, str(tmp_path / "main.txt"))
+    ast = MCPAst(jobs=4)
+    ast.shellcache = MCPShellCache(str(tmp_path / "cache"))
+    ast.process(MCPParser().parse2(lexer))
+
+    assert ast.num_errors == 0
+    assert ast.configValue("A")[0] == ast.configValue("B")[0]
+    # the same call isn't started ahead twice, the second one is cached
+    assert counter.read_text() == "x\n"
+    assert (ast.shellcache.hits, ast.shellcache.misses) == (1, 1)
+
+
+def test_run_cache(tmp_path):
+    from merge_config_plus.cache import MCPShellCache, MCPRunCache
+
+    (tmp_path / "inc.txt").write_text("B=1\n")
+    (tmp_path / "t.txt").write_text("x")
+    (tmp_path / "input").write_text("1")
+    data = (
+        "%(include 'inc.txt')\n"
+        "A=%(file 't.txt')\n"
+        "LOCAL_SHELL_CACHE=y\n"
+        "LOCAL_SHELL_CACHE_INPUTS='input'\n"
+        "C=%(shell 'true')\n"
+    )
+    shellcache = MCPShellCache(str(tmp_path / "shell"))
+    runcache = MCPRunCache(str(tmp_path / "run"))
+
+    def run(data):
+        lexer = MCPLexer()
+        lexer.textAdd(data, str(tmp_path / "main.txt"))
+        ast = MCPAst()
+        ast.shellcache = shellcache
+        ast.process(MCPParser().parse2(lexer))
+        assert ast.num_errors == 0
+
+        manifest = ast.shared.manifest
+        manifest.files.update(lexer.reads)
+        key = runcache.key(["-f", "main.txt"], [data])
+        runcache.store(key, manifest, dict(output="out"))
+        return key
+
+    key = run(data)
+    assert runcache.load(key, shellcache)["output"] == "out"
+
+    for name, text in [("inc.txt", "B=2\n"), ("t.txt", "y"), ("input", "2")]:
+        (tmp_path / name).write_text(text)
+        assert runcache.load(key, shellcache) is None
+        run(data)
+        assert runcache.load(key, shellcache) is not None
+
+    # uncached shell call makes run volatile
+    key = run(data.replace("LOCAL_SHELL_CACHE=y", "LOCAL_SHELL_CACHE=n"))
+    assert runcache.load(key, shellcache) is None
+    assert (runcache.hits, runcache.misses) == (4, 4)
+
+
+def test_run_cache_budget(tmp_path):
+    from merge_config_plus.cache import MCPRunCache, MCPManifest
+
+    runcache = MCPRunCache(str(tmp_path), budget=3500)
+    keys = [runcache.key(["-f", str(n)], []) for n in range(4)]
+
+    for key in keys[:3]:
+        runcache.store(key, MCPManifest(), dict(output="x" * 1000))
+    # the oldest entry goes, unless it was used
+    os.utime(runcache.path(keys[0]), ns=(0, 0))
+    os.utime(runcache.path(keys[1]), ns=(0, 0))
+    assert runcache.load(keys[0], None) is not None
+    runcache.store(keys[3], MCPManifest(), dict(output="x" * 1000))
+
+    assert [runcache.load(key, None) is not None for key in keys] == [True, False, True, True]
+
+
+def test_checkpoint():
+    import pickle
+
+    prefix = (
+        "A='a'\nA+='b'\n"
+        "%(define 'd')\nX+=%(Y)\n%(endef)\n"
+        "P=%(process 'Q=1')\n"
+    )
+    tail = "Y='1'\nX='x'\n%(call 'd')\nA=+'c'\nP=%(process 'Q=1')\n"
+
+    def parse(data):
+        return MCPParser().parse(MCPLexer().tokenize2(data))
+
+    full = MCPAst(history=True)
+    full.process(parse(prefix + tail))
+
+    ast = MCPAst(history=True)
+    ast.process(parse(prefix))
+    state = pickle.loads(pickle.dumps(ast.checkpoint()))
+
+    restored = MCPAst(history=True)
+    restored.restore(state)
+    restored.process(parse(tail))
+
+    # tail was parsed on its own, only line numbers differ
+    def values(ast):
+        return [
+            item if item[0] == "comment" else (item[1], [v[:2] for v in item[2]])
+            for item in ast.configs
+        ]
+
+    assert values(restored) == values(full)
+    assert restored.num_errors == 0
+
+
+# sh script that marks its start and end in log, it waits (up to 4s) till
+# wait scripts are started, so steps that run at once start before any ends
+def barrier(log, name, wait, result):
+    return (
+        "echo s {name} >> {log}; n=0; "
+        "while [ $(grep -c ^s {log}) -lt {wait} ] && [ $n -lt 40 ]; do sleep 0.1; n=$((n+1)); done; "
+        "echo e {name} >> {log}; {result}"
+    ).format(name=name, log=log, wait=wait, result=result)
+
+
+# True if every one of steps started before any of them ended
+def started_together(log, steps):
+    lines = log.read_text().split("\n")
+    starts = [lines.index("s " + step) for step in steps]
+    ends = [lines.index("e " + step) for step in steps]
+    return max(starts) < min(ends)
+
+
+def test_shell_jobs(caplog, tmp_path):
+    results = list()
+    for jobs in [1, 8]:
+        # A, C and failing condition run at once, then B, D and E
+        log = tmp_path / "log{}".format(jobs)
+        wait = 1 if jobs == 1 else 3
+        data = (
+            "A=%(shell 'sh','-c','{a}')\n"
+            "B=%(shell 'sh','-c','echo '.%(A))\n"
+            "C=%(shell 'sh','-c','{c}')\n"
+            "%(ifeq %(shell 'sh','-c','{cond}'),'')\n"
+            "D=%(shell 'sh','-c','echo '.%(C))\n"
+            "%(endif)\n"
+            "E=%(shell 'sh','-c','{e}'.%(UNKNOWN))\n"
+            "F=%(shell '/nonexistent')\n"
+        ).format(
+            a=barrier(log, "A", wait, "echo 1"),
+            c=barrier(log, "C", wait, "echo 3"),
+            cond=barrier(log, "cond", wait, "exit 1"),
+            e=barrier(log, "E", wait, "echo "),
+        )
+
+        caplog.clear()
+        ast = MCPAst(jobs=jobs)
+        ast.process(MCPParser().parse(MCPLexer().tokenize2(data)))
+
+        results.append(
+            (
+                [item for item in ast.configs],
+                ast.num_errors,
+                [(r.levelname, r.getMessage()) for r in caplog.records],
+            )
+        )
+
+    assert results[0] == results[1]
+    assert results[1][1] == 3
+    assert started_together(log, ["A", "C", "cond"])
+
+
+test_async = [
+    "A=1\nB=%(A).'2'\n%(ifeq %(B),'12')\nC=y\n%(else)\nC=n\n%(endif)",
+    "%(define 'd')\nA+=%(strip %(shell 'echo','-n','x'))\n%(endef)\nA=''\n%(call 'd')\n%(call 'd')",
+    "A=%(shell 'sh','-c','exit 3')\nB=%(file '/nonexistent')\nC=%(UNKNOWN)",
+    "A=%(strip %(shell 'echo','a')).%(process 'B=1')",
+    "%(ifneq %(shell 'echo'),'')\nA=%(shell 'echo','-n','t')\n%(endif)",
+]
+
+
+@pytest.mark.parametrize("data", test_async)
+def test_process_async(data):
+    sync = process(data)
+
+    ast = MCPAst()
+    asyncio.run(ast.process_async(MCPParser().parse(MCPLexer().tokenize2(data))))
+
+    assert list(ast.configs) == list(sync.configs)
+    assert ast.num_errors == sync.num_errors
+
+
+def test_process_async_concurrent(tmp_path):
+    log = tmp_path / "log"
+    # args of strip wait at once, steps of the first line go first
+    shell = lambda name, wait: "%(shell 'sh','-c','{}')".format(
+        barrier(log, name, wait, "true")
+    )
+    data = (
+        "A=%(strip {a},{b})\n"
+        "B=''.%(file '/dev/null').%(strip {c}).%(strip {d})\n"
+    ).format(a=shell("a", 2), b=shell("b", 2), c=shell("c", 4), d=shell("d", 4))
+
+    ast = MCPAst()
+    asyncio.run(ast.process_async(MCPParser().parse(MCPLexer().tokenize2(data))))
+
+    assert ast.num_errors == 0
+    assert started_together(log, ["a", "b"])
+    assert started_together(log, ["c", "d"])
+
+
+def test_process_shared(tmp_path):
+    counter = tmp_path / "counter"
+    counter.write_text("")
+    data = (
+        "%(define 'd')\n"
+        "A+=%(process 'B=y','C=%(strip %(shell \"sh\",\"-c\",\"echo x >> {counter}\"))')\n"
+        "%(endef)\n"
+        "A=''\n"
+        "%(call 'd')\n%(call 'd')\n%(call 'd')\n"
+        "E=1\nF=%(process 'G=%(E)')\nH=%(process 'G=%(E)')\n"
+    ).format(counter=counter)
+
+    lexer = MCPLexer()
+    lexer.textAdd(data, str(tmp_path / "main.txt"))
+    ast = MCPAst()
+    ast.process(MCPParser().parse2(lexer))
+
+    # sub runs don't see parent vars, failed runs are repeated
+    assert ast.num_errors == 2
+    assert counter.read_text() == "x\n"
+    assert ast.configValue("A")[0].count("B=y") == 3
+    assert len(ast.shared.processes) == 1
+
+
+def test_process_parser(tmp_path):
+    lexer = MCPLexer()
+    lexer.textAdd("A=%(process 'B=(')\n", str(tmp_path / "main.txt"))
+    parser = MCPParser()
+    ast = MCPAst(parser=parser)
+    ast.process(parser.parse2(lexer))
+
+    # sub runs use parser of the run, failed one is reported once
+    assert ast.shared.parser is parser
+    assert parser.num_errors == 1
+    assert ast.num_errors == 1
+
+
+def test_process_jobs(caplog, tmp_path):
+    results = list()
+    for jobs in [1, 4]:
+        # sub runs of A, C, D and E run at once, F takes result of A
+        log = tmp_path / "log{}".format(jobs)
+        wait = 1 if jobs == 1 else 3
+        shell = lambda name, result: '%(strip %(shell "sh","-c","{}"))'.format(
+            barrier(log, name, wait, result)
+        )
+        data = (
+            "B=2\n"
+            "A=%(process 'X={a}')\n"
+            "C=%(process 'X={c}','Y='.%(B))\n"
+            "D=%(process 'X={d}')\n"
+            "E=%(process 'X=%(UNKNOWN)')\n"
+            "F=%(process 'X={a}')\n"
+        ).format(a=shell("A", "echo 1"), c=shell("C", "echo 3"), d=shell("D", "echo 2"))
+
+        caplog.clear()
+        ast = MCPAst(jobs=jobs)
+        ast.process(MCPParser().parse(MCPLexer().tokenize2(data)))
+
+        results.append(
+            (
+                [item for item in ast.configs],
+                ast.num_errors,
+                [(r.name, r.levelname, r.getMessage()) for r in caplog.records],
+            )
+        )
+
+    assert results[0] == results[1]
+    assert results[1][1] == 1
+    assert started_together(log, ["A", "C", "D"])
+
+
+def test_rope():
+    data = "LOCAL_A=''\n" + "LOCAL_A+='a'\nLOCAL_A=+'b'\n" * 1000 + "B=%(LOCAL_A)\nB+=1\nB-='a'"
+    ast = process(data)
+
+    assert ast.configValue("LOCAL_A")[0] == "b" * 1000 + "a" * 1000
+    assert ast.configValue("B")[0] == "b" * 1000 + "1"
+    # values are plain strings after processing
+    for item in ast.configs:
+        if item[0] == "config":
+            assert item[2][-1][1].__class__ in (str, int)
+
+
+def test_rope_history():
+    from merge_config_plus.configs import MCPRope
+
+    a = MCPRope("1")
+    b = a.append("2")
+    c = b.prepend("0")
+    # a is extended again, b keeps its own value
+    d = a.append("3")
+
+    assert [str(x) for x in (a, b, c, d)] == ["1", "12", "012", "13"]
+    assert d.append("4") == "134" and c == MCPRope("012")
+
+    ast = MCPAst(history=True)
+    ast.process(MCPParser().parse(MCPLexer().tokenize2("A='1'\nA+='2'\nA=+'0'\nA+=3")))
+    assert [value[1] for value in ast.configs.get("A")[2]] == ["1", "12", "012", "0123"]
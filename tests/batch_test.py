@@ -0,0 +1,45 @@
+import pytest
+import os
+import sys
+import json
+import subprocess
+
+
+def mcp(*args, cwd):
+    env = dict(os.environ, MCP_CACHE_DIR="")
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run(
+        [sys.executable, "-m", "merge_config_plus"] + list(args),
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_batch(tmp_path, workers):
+    (tmp_path / "base.txt").write_text("A='a'\n%(define 'd')\nB+=%(A)\n%(endef)\n")
+    (tmp_path / "v1.txt").write_text("B='1'\n%(call 'd')\n")
+    (tmp_path / "v2.txt").write_text("%(call 'e')\n")
+    jobs = [
+        {"files": ["base.txt", "v1.txt"], "output": "v1.config", "append": "C=1"},
+        {"files": ["base.txt", "v2.txt"], "output": "v2.config"},
+        {"files": ["v1.txt"], "args": ["--strip-include"]},
+    ]
+    (tmp_path / "jobs.json").write_text(json.dumps({"args": ["--history"], "jobs": jobs}))
+
+    single = mcp("--history", "-f", "base.txt", "v1.txt", "-a", "C=1", "-o", "single.config", cwd=str(tmp_path))
+    assert single.returncode == 0
+
+    r = mcp("--batch", "jobs.json", "--batch-jobs", workers, cwd=str(tmp_path))
+
+    assert r.returncode == 1
+    assert (tmp_path / "v1.config").read_text() == (tmp_path / "single.config").read_text()
+    assert not (tmp_path / "v2.config").exists()
+    # failed job with stdout output prints nothing
+    assert r.stdout == ""
+    assert "Job 2/3 '{}' failed with code 1, 1 errors".format(tmp_path / "v2.config") in r.stderr
+    assert "Job 3/3 '-' failed with code 1, 1 errors" in r.stderr
+    assert "Batch: 3 jobs, 2 failed in" in r.stderr
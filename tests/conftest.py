@@ -0,0 +1,10 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    # tests don't read or fill cache of the user, tests of caching use
+    # their own dirs
+    path = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("MCP_CACHE_DIR", str(path))
+    return path
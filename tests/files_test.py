@@ -0,0 +1,136 @@
+import pytest
+import os
+
+from merge_config_plus import MCPLexer
+from merge_config_plus import MCPParser
+from merge_config_plus import MCPAst
+from merge_config_plus.files import MCPFiles, files
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(MCPFiles, "racy", 0)
+    return MCPFiles(budget=100, mmap_min=16)
+
+
+def test_files_validate(tmp_path, cache):
+    path = str(tmp_path / "a")
+    with open(path, "w") as f:
+        f.write("1")
+
+    assert cache.read(path) == "1"
+    assert cache.read(path) == "1"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    with open(path, "w") as f:
+        f.write("22")
+    assert cache.read(path) == "22"
+
+    # same size, mtime set back
+    st = os.stat(path)
+    with open(path, "w") as f:
+        f.write("33")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert cache.read(path) == "33"
+
+
+def test_files_decode(tmp_path, cache):
+    data = b"a\r\nb\rc\n\xd0\xb6" * 10
+    path = tmp_path / "a"
+    path.write_bytes(data)
+
+    with open(str(path), "r") as f:
+        expected = f.read()
+
+    # mapped, small files are read
+    assert cache.read(str(path)) == expected
+    cache.mmap_min = None
+    cache.clear()
+    assert cache.read(str(path)) == expected
+
+
+def test_files_budget(tmp_path, cache):
+    for name in "abc":
+        (tmp_path / name).write_text(name * 40)
+        cache.read(str(tmp_path / name))
+
+    assert list(cache.entries) == [str(tmp_path / "b"), str(tmp_path / "c")]
+    assert cache.size == 80
+
+    with pytest.raises(FileNotFoundError) as e:
+        cache.read(str(tmp_path / "d"))
+    assert str(tmp_path / "d") in str(e.value)
+
+
+def test_files_racy(tmp_path):
+    cache = MCPFiles()
+    (tmp_path / "a").write_text("1")
+
+    cache.read(str(tmp_path / "a"))
+    assert len(cache.entries) == 0
+
+
+def test_files_sweep(tmp_path, cache):
+    for name in "abc":
+        (tmp_path / name).write_text(name)
+        cache.read(str(tmp_path / name))
+
+    (tmp_path / "a").write_text("aa")
+    os.remove(str(tmp_path / "b"))
+
+    assert cache.sweep() == 2
+    assert list(cache.entries) == [str(tmp_path / "c")]
+    assert cache.size == 1
+
+
+def test_file_function(tmp_path, monkeypatch):
+    monkeypatch.setattr(MCPFiles, "racy", 0)
+    (tmp_path / "t.txt").write_text("x")
+    data = "%(define 'd')\nA+=%(file 't.txt')\n%(endef)\nA=''\n" + "%(call 'd')\n" * 5
+
+    files.clear()
+    hits = files.hits
+    lexer = MCPLexer()
+    lexer.textAdd(data, str(tmp_path / "main.txt"))
+    ast = MCPAst()
+    ast.process(MCPParser().parse2(lexer))
+
+    assert ast.configValue("A")[0] == "xxxxx"
+    assert files.hits - hits == 4
+
+
+def test_files_write(tmp_path, cache):
+    path = tmp_path / "a"
+
+    assert cache.write(str(path), "1\n")
+    assert path.read_text() == "1\n"
+    os.chmod(str(path), 0o640)
+    st = os.stat(str(path))
+
+    assert not cache.write(str(path), "1\n")
+    assert os.stat(str(path)) == st
+
+    assert cache.read(str(path)) == "1\n"
+    assert cache.write(str(path), "2\n")
+    assert cache.read(str(path)) == "2\n"
+    assert os.stat(str(path)).st_ino != st.st_ino
+    assert os.stat(str(path)).st_mode == st.st_mode
+    assert os.listdir(str(tmp_path)) == ["a"]
+
+    with pytest.raises(IsADirectoryError):
+        cache.write(str(tmp_path), "")
+
+
+def test_save_outputs(tmp_path):
+    (tmp_path / "same.txt").write_text("x")
+    data = "A=%(save 'same.txt','x')\nB=%(save 'new.txt','y')\nC=%(save 'new.txt','y')\n"
+
+    lexer = MCPLexer()
+    lexer.textAdd(data, str(tmp_path / "main.txt"))
+    ast = MCPAst()
+    ast.process(MCPParser().parse2(lexer))
+
+    assert ast.shared.outputs == {
+        str(tmp_path / "same.txt"): False,
+        str(tmp_path / "new.txt"): True,
+    }
@@ -0,0 +1,54 @@
+import pytest
+
+from merge_config_plus import MCPLexer
+from merge_config_plus import MCPParser
+from merge_config_plus import MCPAst
+from merge_config_plus.format import MCPTemplate
+
+
+def process(data):
+    lexer = MCPLexer()
+    parser = MCPParser()
+    ast = MCPAst()
+
+    ast.process(parser.parse(lexer.tokenize2(data)))
+
+    return ast
+
+
+test_templates = [
+    ("a {x} b {y}", {"x": "1", "y": "2"}, "a 1 b 2", [], True),
+    ("{{x}} {x!r} {x:>4}", {"x": "1"}, "{x} '1'    1", [], True),
+    ("{y} {x} {y}", {"x": "1"}, "{y} 1 {y}", ["y"], True),
+    ("{x:>5}", {}, "  {x}", ["x"], True),
+    # left to str.format()
+    ("{x[0]} {y}", {"x": "ab"}, "a {y}", ["y"], False),
+]
+
+
+@pytest.mark.parametrize("text,vars,result,missing,compiled", test_templates)
+def test_template(text, vars, result, missing, compiled):
+    template = MCPTemplate(text)
+
+    assert (template.fields is not None) == compiled
+    assert template.render(vars) == (result, missing)
+
+
+def test_template_errors():
+    with pytest.raises(IndexError):
+        MCPTemplate("{0}").render({})
+    with pytest.raises(ValueError):
+        MCPTemplate("{x").render({})
+
+
+def test_format_missing(caplog):
+    # recursion with every missing key used to hit recursion limit
+    names = ["v{}".format(i) for i in range(2000)]
+    template = " ".join("{" + name + "}" for name in names)
+    data = "A=%(format '{}','v1=x')".format(template)
+
+    ast = process(data)
+
+    assert ast.num_errors == len(names) - 1
+    assert ast.configValue("A")[0] == template.replace("{v1}", "x")
+    assert caplog.records[0].getMessage() == "Var 'v0' required by template, but not provided"
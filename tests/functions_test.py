@@ -0,0 +1,69 @@
+import pytest
+
+from merge_config_plus import MCPLexer
+from merge_config_plus import MCPParser
+from merge_config_plus import MCPAst
+from merge_config_plus.functions import MCPMemo, functions, function
+
+
+def process(data):
+    lexer = MCPLexer()
+    parser = MCPParser()
+    ast = MCPAst()
+
+    ast.process(parser.parse(lexer.tokenize2(data)))
+
+    return ast
+
+
+def test_memo():
+    memo = MCPMemo(size=2)
+
+    memo.put(("a",), "1")
+    memo.put(("b",), "2")
+    assert memo.get(("a",)) == "1"
+    memo.put(("c",), "3")
+
+    assert memo.get(("b",)) is None
+    assert memo.get(("a",)) == "1"
+    assert memo.get(("c",)) == "3"
+
+
+def test_register():
+    calls = list()
+
+    @function("test_upper", pure=True)
+    def func_upper(ast, args, line, file):
+        calls.append(args)
+        return "".join(args).upper()
+
+    try:
+        ast = process("A=%(test_upper 'a','b')\nB=%(test_upper 'a','b')")
+    finally:
+        del functions["test_upper"]
+
+    assert ast.configValue("A") == ("AB", "string", True)
+    assert ast.configValue("B") == ("AB", "string", True)
+    assert calls == [["a", "b"]]
+
+
+@pytest.mark.parametrize("name", ["strip", "diff", "format", "major", "minor", "patch", "relpath"])
+def test_pure(name):
+    assert functions[name].pure
+    assert functions[name].memo is not None
+
+
+def test_errors_repeated():
+    ast = process("A=%(major 'x')\nB=%(major 'x')\nC=%(major '1.2')\nD=%(major '1.2')")
+
+    assert ast.num_errors == 2
+    assert ast.configValue("D") == ("1", "string", True)
+
+
+@pytest.mark.parametrize("a,b", [("", ""), ("a\nb", "a\nb"), ("", "a\nb"), ("a\nb\nc", "a\nc\nd")])
+def test_diff(a, b):
+    import difflib
+
+    expected = "".join(difflib.unified_diff(a.split("\n"), b.split("\n"), n=6))
+
+    assert functions["diff"].method(MCPAst(), [a, b], 0, "/") == expected
@@ -2,24 +2,26 @@ import pytest
 
 from merge_config_plus import MCPLexer
 from merge_config_plus import MCPParser
+from merge_config_plus.nodes import Config, State, Int, Hex, Val, Str, String
+from merge_config_plus.nodes import Include, If
 
 test_var_assign = [
-    ("TEST=1", [("config", "TEST", "=", ("int", 1))]),
-    ("TEST=0", [("config", "TEST", "=", ("int", 0))]),
-    ("TEST=0x0", [("config", "TEST", "=", ("hex", 0))]),
-    ("TEST=0xf", [("config", "TEST", "=", ("hex", 0xF))]),
-    ("TEST=y", [("config", "TEST", "=", ("state", "y"))]),
-    ("TEST=m", [("config", "TEST", "=", ("state", "m"))]),
-    ("TEST=n", [("config", "TEST", "=", ("state", "n"))]),
-    ("# TEST is not set", [("config", "TEST", "=", ("state", "n"))]),
-    ("TEST='abc'", [("config", "TEST", "=", ("string", [("str", "abc")]))]),
-    ("TEST=%(VAR1)", [("config", "TEST", "=", ("val", "VAR1"))]),
+    ("TEST=1", [Config("TEST", "=", Int(1), 1, "/")]),
+    ("TEST=0", [Config("TEST", "=", Int(0), 1, "/")]),
+    ("TEST=0x0", [Config("TEST", "=", Hex(0), 1, "/")]),
+    ("TEST=0xf", [Config("TEST", "=", Hex(0xF), 1, "/")]),
+    ("TEST=y", [Config("TEST", "=", State("y"), 1, "/")]),
+    ("TEST=m", [Config("TEST", "=", State("m"), 1, "/")]),
+    ("TEST=n", [Config("TEST", "=", State("n"), 1, "/")]),
+    ("# TEST is not set", [Config("TEST", "=", State("n"), 1, "/")]),
+    ("TEST='abc'", [Config("TEST", "=", String((Str("abc"),)), 1, "/")]),
+    ("TEST=%(VAR1)", [Config("TEST", "=", Val("VAR1"), 1, "/")]),
 ]
 
 test_string = [
     (
         "S='a'.'b'.'c'",
-        [("config", "S", "=", ("string", [("str", "a"), ("str", "b"), ("str", "c")]))],
+        [Config("S", "=", String((Str("a"), Str("b"), Str("c"))), 1, "/")],
     ),
     ("S=%(VAR).'a'.'b'", [()]),
     ("S=%'a'.%(VAR).'b'", [()]),
@@ -72,7 +74,101 @@ def test_parser(data, tarr):
 
     counter = 0
     for item in ast:
-        assert item[:-1] == tarr[counter]
+        assert item == tarr[counter]
         counter += 1
 
     assert counter == len(tarr)
+
+
+def test_include_cache(tmp_path):
+    from merge_config_plus.cache import MCPCache
+
+    (tmp_path / "main.txt").write_text('A=1\n%(ifeq %(A),"1")\n%(include "inc.txt")\n%(endif)\n')
+    (tmp_path / "inc.txt").write_text("B=%(A)\n")
+    main = str(tmp_path / "main.txt")
+    inc = str(tmp_path / "inc.txt")
+
+    results = list()
+    for i in range(2):
+        lexer = MCPLexer()
+        lexer.textAdd((tmp_path / "main.txt").read_text(), main)
+        parser = MCPParser()
+        parser.cache = MCPCache("ast", str(tmp_path / "cache"))
+
+        results.append((parser.parse2(lexer), lexer.hierarchy))
+        assert parser.num_errors + lexer.num_errors == 0
+
+    assert results[0] == results[1]
+    assert len(list((tmp_path / "cache").iterdir())) == 2
+
+    ast, hierarchy = results[1]
+    assert ast[1].__class__ is If
+    assert ast[1].true == (Include(inc, [Config("B", "=", Val("A"), 1, inc)]),)
+    assert hierarchy == [(main, [(inc, [], "")], "")]
+
+
+def test_ast_cache_budget(tmp_path):
+    from merge_config_plus.cache import MCPCache
+
+    main = str(tmp_path / "main.txt")
+    parser = MCPParser()
+    parser.cache = MCPCache("ast", str(tmp_path / "cache"), budget=1)
+
+    # every edit of file leaves only its last parse result
+    for i in range(3):
+        lexer = MCPLexer()
+        lexer.textAdd("A={}\n".format(i), main)
+        assert parser.parse2(lexer) is not None
+
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+
+def test_include_resolve_shared(tmp_path):
+    import os
+    from merge_config_plus.cache import MCPCache
+
+    (tmp_path / "inc.txt").write_text("B=1\n")
+    text = 'A=1\n%(ifeq %(A),"1")\n%(include "inc.txt")\n%(endif)\n'
+    main = str(tmp_path / "main.txt")
+    inc = str(tmp_path / "inc.txt")
+    resolved = (Include(inc, [Config("B", "=", Int(1), 1, inc)]),)
+
+    # the same parsed text (from memo and AST cache) with different includes
+    parser = MCPParser()
+    parser.cache = MCPCache("ast", str(tmp_path / "cache"))
+
+    def parse(parser):
+        lexer = MCPLexer()
+        lexer.textAdd(text, main)
+        return parser.parse2(lexer), lexer.num_errors
+
+    first, errors = parse(parser)
+    assert errors == 0
+    assert first[1].true == resolved
+
+    os.remove(inc)
+    for p in (parser, MCPParser()):
+        p.cache = parser.cache
+        second, errors = parse(p)
+        assert errors == 1
+        assert second[1].true == (Include(inc),)
+
+    assert first[1].true == resolved
+
+
+def test_ast_cache_stamp(tmp_path, monkeypatch):
+    from merge_config_plus.cache import MCPCache
+
+    main = str(tmp_path / "main.txt")
+    cache = MCPCache("ast", str(tmp_path / "cache"))
+
+    # parse results of other package code aren't used
+    for stamp in ["old", "new", "new"]:
+        monkeypatch.setattr(MCPParser, "stamp", stamp)
+        parser = MCPParser()
+        parser.cache = cache
+        lexer = MCPLexer()
+        lexer.textAdd("A=1\n", main)
+        assert parser.parse2(lexer) is not None
+
+    assert len(list((tmp_path / "cache").iterdir())) == 2
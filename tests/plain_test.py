@@ -0,0 +1,85 @@
+import os
+import pytest
+
+from merge_config_plus import MCPLexer
+from merge_config_plus import MCPParser
+from merge_config_plus.plain import MCPPlain
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+def parse(data, file):
+    lexer = MCPLexer()
+    parser = MCPParser()
+
+    return parser.parse(lexer.tokenize(data, file=file))
+
+
+test_plain = [
+    "A=y",
+    "A=m\nB=n\n",
+    "# A is not set",
+    "  # A is not set  # comment",
+    "# comment\n\n#\n##",
+    "A = 0x1f # c ",
+    "A=-5\nB=+5\nC?=1\nD-='x'\nE+=\"y\"",
+    "A='a\\tb\\nc'",
+    'A="#x"#y',
+    "Aa_1?=n",
+]
+
+
+@pytest.mark.parametrize("data", test_plain)
+def test_plain(data):
+    assert MCPPlain().scan(data, "/file") == parse(data, "/file")
+
+
+test_not_plain = [
+    "A=yes",
+    "A=y # B is not set",
+    "# A is not settled",
+    'A="x" . "y"',
+    "A=1 B=2",
+    "#\nA is not set",
+    'A="1\n2"',
+    "A=%(B)",
+    '%(include "file")',
+    "A=y\r\n",
+]
+
+
+@pytest.mark.parametrize("data", test_not_plain)
+def test_not_plain(data):
+    assert MCPPlain().scan(data, "/file") == None
+
+
+@pytest.mark.parametrize("name", ["br.config", "busybox.config", "kernel.config"])
+def test_real(name):
+    path = os.path.join(DATA, "real", name)
+    with open(path, "r") as f:
+        data = f.read()
+
+    assert MCPPlain().scan(data, path) == parse(data, path)
+
+
+test_mixed = [
+    ("A=1", "", ""),
+    ("A=1\nB=%(A)", "", ""),
+    ("A=1", "P='p'", "B=%(A)"),
+    ("", "", ""),
+]
+
+
+@pytest.mark.parametrize("data,prepend,append", test_mixed)
+def test_parse2(data, prepend, append):
+    lexer = MCPLexer()
+    lexer.textAdd(data, "/file")
+    parser = MCPParser()
+    r = parser.parse(lexer.tokenize2(prepend=prepend, append=append))
+
+    lexer = MCPLexer()
+    lexer.textAdd(data, "/file")
+    parser2 = MCPParser()
+
+    assert parser2.parse2(lexer, prepend=prepend, append=append) == r
+    assert parser2.num_errors == parser.num_errors
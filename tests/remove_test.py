@@ -0,0 +1,81 @@
+import pytest
+import random
+
+from merge_config_plus import MCPLexer
+from merge_config_plus import MCPParser
+from merge_config_plus import MCPAst
+from merge_config_plus.remove import MCPRemover
+
+
+def process(data):
+    lexer = MCPLexer()
+    parser = MCPParser()
+    ast = MCPAst()
+
+    ast.process(parser.parse(lexer.tokenize2(data)))
+
+    return ast
+
+
+def sequential(text, patterns):
+    for pattern in patterns:
+        text = text.replace(pattern, "")
+    return text
+
+
+test_removes = [
+    ("a b c d ", ["b ", "d "], True),
+    # removing 'X' makes 'ab', that is removed only one by one
+    ("aXbc", ["X", "ab"], True),
+    ("aabb", ["ab", "ab"], True),
+    # 'ab' and 'bc' overlap
+    ("abc", ["bc", "ab"], False),
+    ("abc", ["b", "abc"], False),
+    ("abc", ["", "c"], True),
+]
+
+
+@pytest.mark.parametrize("text,patterns,batch", test_removes)
+def test_remove(monkeypatch, text, patterns, batch):
+    monkeypatch.setattr(MCPRemover, "batch_min", 1)
+    remover = MCPRemover(patterns)
+
+    assert (remover.regex is not None) == batch
+    assert remover.apply(text) == sequential(text, patterns)
+
+
+def test_remove_random(monkeypatch):
+    monkeypatch.setattr(MCPRemover, "batch_min", 1)
+    rand = random.Random(0)
+
+    for _ in range(5000):
+        patterns = [
+            "".join(rand.choice("abc") for _ in range(rand.randint(0, 4)))
+            for _ in range(rand.randint(1, 5))
+        ]
+        text = "".join(rand.choice("abc ") for _ in range(rand.randint(0, 30)))
+
+        assert MCPRemover(patterns).apply(text) == sequential(text, patterns)
+
+
+def test_remove_batch():
+    packages = ["pkg{}".format(i) for i in range(200)]
+    removed = packages[::2]
+    data = "LOCAL_A='{}'\n".format(" ".join(packages) + " ")
+    data += "".join("LOCAL_A-='{} '\n".format(name) for name in removed)
+    data += "B=%(LOCAL_A)\n"
+    data += "C=%(remove %(LOCAL_A),'pkg1 ','pkg2 ')\n"
+
+    items = MCPParser().parse(MCPLexer().tokenize2(data))
+    ast = MCPAst()
+    ast.process(items)
+    expected = sequential(" ".join(packages) + " ", [name + " " for name in removed])
+
+    assert ast.num_errors == 0
+    assert ast.configValue("B")[0] == expected
+    assert ast.configValue("C")[0] == expected.replace("pkg1 ", "").replace("pkg2 ", "")
+
+    # all -= are one step
+    steps = list()
+    MCPAst().compile_items(items, steps, list())
+    assert len(steps) == 4
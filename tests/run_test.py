@@ -0,0 +1,53 @@
+import pytest
+import os
+import sys
+import subprocess
+
+
+def mcp(*args, cwd):
+    env = dict(os.environ, MCP_CACHE_DIR=os.path.join(cwd, "cache"))
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run(
+        [sys.executable, "-m", "merge_config_plus"] + list(args),
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--checkpoint", "1", "-f", "p.config"],
+        ["--checkpoint", "5", "-f", "p.config"],
+        ["--checkpoint", "1", "-f", "p.config", "-p", "B=2"],
+        ["--checkpoint", "1", "-f", "p.config", "t.config"],
+        ["--checkpoint", "1", "-f", "p.config", "empty.config"],
+        ["--checkpoint", "1", "-f", "p.config", "empty.config", "blank.config"],
+    ],
+)
+def test_checkpoint_repeated(tmp_path, args):
+    (tmp_path / "p.config").write_text("A=1\n")
+    (tmp_path / "t.config").write_text("C=3\n")
+    (tmp_path / "empty.config").write_text("")
+    (tmp_path / "blank.config").write_text("\n  \n")
+
+    outputs = list()
+    for _ in range(2):
+        r = mcp("--no-run-cache", "-o", "out.config", *args, cwd=str(tmp_path))
+        assert r.returncode == 0, r.stderr
+        outputs.append((tmp_path / "out.config").read_text())
+
+    assert outputs[0] == outputs[1]
+    assert "A=1" in outputs[1]
+
+
+def test_process_errors(tmp_path):
+    (tmp_path / "p.config").write_text("A=1\nB=%(process 'C=(')\n")
+
+    # parse error of sub run isn't counted by the run again
+    r = mcp("--no-run-cache", "-f", "p.config", cwd=str(tmp_path))
+    assert r.returncode == 1
+    assert "there were 1 warnings/errors" in r.stderr
@@ -0,0 +1,107 @@
+import pytest
+import os
+import sys
+import time
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT = os.path.join(BASE_DIR, "merge_config_plus_client.py")
+
+
+def environ(**kwargs):
+    env = dict(os.environ, MCP_CACHE_DIR="", PYTHONPATH=BASE_DIR)
+    env.pop("MCP_SOCKET", None)
+    env.update(kwargs)
+    return env
+
+
+def run(command, cwd, env, stdin=""):
+    return subprocess.run(
+        command,
+        cwd=cwd,
+        env=env,
+        input=stdin,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / "mcp.sock")
+    p = subprocess.Popen(
+        [sys.executable, "-m", "merge_config_plus", "--serve", path],
+        env=environ(),
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    for _ in range(100):
+        if os.path.exists(path) or p.poll() is not None:
+            break
+        time.sleep(0.1)
+    assert os.path.exists(path)
+
+    yield path
+
+    p.terminate()
+    _, stderr = p.communicate(timeout=10)
+    assert p.returncode == 0
+    assert "Server stopped after" in stderr
+    assert not os.path.exists(path)
+
+
+def test_serve(tmp_path, server):
+    (tmp_path / "inc.txt").write_text("B='1'\n")
+    (tmp_path / "main.txt").write_text(
+        "%(shell 'sh','-c','test \"$X\" = x')\n%(include 'inc.txt')\n"
+    )
+
+    def compare(*args, stdin=""):
+        # the same command by one-shot CLI and by client
+        results = list()
+        for command, output in (
+            ([sys.executable, "-m", "merge_config_plus"], "cli.config"),
+            ([sys.executable, CLIENT], "serve.config"),
+        ):
+            r = run(
+                command + ["-o", output] + list(args),
+                cwd=str(tmp_path),
+                env=environ(MCP_SOCKET=server, X="x"),
+                stdin=stdin,
+            )
+            text = (tmp_path / output).read_text() if (tmp_path / output).exists() else None
+            results.append((r.returncode, r.stdout, r.stderr.replace(output, "OUT"), text))
+        assert results[0] == results[1]
+        return results[1]
+
+    code, _, _, text = compare("-f", "main.txt")
+    assert code == 0
+    assert "B=\"1\"" in text
+
+    # changed include is read again
+    (tmp_path / "inc.txt").write_text("B='2'\n")
+    code, _, _, text = compare("-f", "main.txt")
+    assert "B=\"2\"" in text
+
+    code, _, stderr, text = compare("-f", "main.txt", "-a", "%(call 'e')")
+    assert code == 1 and text is None and "1 warnings/errors" in stderr
+
+    code, _, _, text = compare("-f", "-", stdin="C=3\n")
+    assert code == 0 and "C=3" in text
+
+    code, _, stderr, _ = compare("-f", "missing.txt")
+    assert code == 2 and "can't open 'missing.txt'" in stderr
+
+
+def test_serve_fallback(tmp_path):
+    (tmp_path / "main.txt").write_text("A=1\n")
+
+    # no server, client runs one-shot CLI itself
+    r = run(
+        [sys.executable, CLIENT, "-f", "main.txt"],
+        cwd=str(tmp_path),
+        env=environ(MCP_SOCKET=str(tmp_path / "none.sock")),
+    )
+    assert r.returncode == 0
+    assert "A=1" in r.stdout